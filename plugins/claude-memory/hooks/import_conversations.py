@@ -9,12 +9,14 @@ v3 schema: messages stored once per session, branches as separate index.
 """
 
 import argparse
-import hashlib
-import json
+import os
 import sqlite3
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Iterator, Optional
 
 # Add path to shared utils
 SCRIPT_DIR = Path(__file__).resolve().parent
@@ -25,74 +27,43 @@ from memory_utils import (
     DEFAULT_PROJECTS_DIR,
     get_db_path,
     get_db_connection,
+    close_db_connection,
     load_settings,
     setup_logging,
     parse_project_key,
     extract_project_name,
-    extract_text_content,
-    is_tool_result,
-    parse_jsonl_file,
-    parse_all_with_uuids,
-    extract_session_metadata,
-    find_all_branches,
-    compute_branch_metadata,
+    replace_branch_lists,
+    delete_branch_lists,
+    bulk_insert_messages,
+    bulk_import,
+    BulkImport,
+    BatchedWriter,
+    ParsedSession,
+    parse_session_file,
+    build_fts_query,
+    BRANCH_MESSAGE_INSERT_SQL,
 )
 
 
-def get_file_hash(filepath: Path) -> str:
-    """Get MD5 hash of file for change detection."""
-    h = hashlib.md5()
-    with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
-    return h.hexdigest()
+# Maps parse_session_file over (paths, known hashes), preserving order:
+# the builtin map, or a process pool's map
+ParseMap = Callable[..., Iterator[Optional[ParsedSession]]]
 
 
 def import_session(
     conn: sqlite3.Connection,
+    parsed: ParsedSession,
     filepath: Path,
     project_id: int,
     parent_session_id: Optional[int] = None
 ) -> tuple[int, int]:
     """
-    Import a single session JSONL file with v3 schema.
+    Write a parsed session JSONL file with v3 schema.
     Messages stored once, branches tracked via branch_messages.
     Returns: (branches_imported, total_message_count)
     """
     cursor = conn.cursor()
-
-    # Check if already imported with same hash
-    file_hash = get_file_hash(filepath)
-    cursor.execute(
-        "SELECT id, file_hash FROM import_log WHERE file_path = ?",
-        (str(filepath),)
-    )
-    log_row = cursor.fetchone()
-    if log_row and log_row[1] == file_hash:
-        return -1, 0
-
-    # Parse all entries for branch detection
-    all_entries = list(parse_all_with_uuids(filepath))
-    if not all_entries:
-        return -1, 0
-
-    # Find all branches
-    branches = find_all_branches(all_entries)
-    if not branches:
-        return -1, 0
-
-    # Parse user/assistant messages
-    messages = list(parse_jsonl_file(filepath))
-    if not messages:
-        return -1, 0
-
-    # Extract session UUID from filename
-    session_uuid = filepath.stem
-    if session_uuid.startswith("agent-"):
-        session_uuid = session_uuid[6:]
-
-    # Extract session-level metadata
-    meta = extract_session_metadata(all_entries)
+    session_uuid = parsed.session_uuid
 
     # Step 1: Upsert ONE session row
     cursor.execute("""
@@ -103,55 +74,10 @@ def import_session(
             cwd = COALESCE(excluded.cwd, sessions.cwd),
             parent_session_id = COALESCE(excluded.parent_session_id, sessions.parent_session_id)
         RETURNING id
-    """, (session_uuid, project_id, parent_session_id, meta["git_branch"], meta["cwd"]))
+    """, (session_uuid, project_id, parent_session_id, parsed.git_branch, parsed.cwd))
     session_id = cursor.fetchone()[0]
 
-    # Step 2: Insert ALL messages once (delete + reinsert for re-import)
-    cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-
-    total_messages = 0
-    for entry in messages:
-        entry_type = entry.get("type")
-        if entry_type not in ("user", "assistant"):
-            continue
-
-        message = entry.get("message", {})
-        content = message.get("content", "")
-
-        if entry_type == "user" and is_tool_result(content):
-            continue
-
-        text, has_tool_use, has_thinking, tool_summary = extract_text_content(content)
-        if not text:
-            continue
-
-        cursor.execute("""
-            INSERT INTO messages (session_id, uuid, parent_uuid, timestamp, role, content, tool_summary, has_tool_use, has_thinking)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(session_id, uuid) DO NOTHING
-        """, (
-            session_id,
-            entry.get("uuid"),
-            entry.get("parentUuid"),
-            entry.get("timestamp"),
-            entry_type,
-            text,
-            tool_summary,
-            has_tool_use,
-            has_thinking,
-        ))
-        if cursor.rowcount > 0:
-            total_messages += 1
-
-    # Step 3: Build uuid -> message_id mapping
-    cursor.execute(
-        "SELECT id, uuid FROM messages WHERE session_id = ? AND uuid IS NOT NULL",
-        (session_id,)
-    )
-    uuid_to_msg_id = {row[1]: row[0] for row in cursor.fetchall()}
-
-    # Step 4: Upsert branches + rebuild branch_messages
-    # First, clear old branches for this session
+    # Step 2: Clear old branches for this session; they reference its messages
     cursor.execute(
         "SELECT id FROM branches WHERE session_id = ?",
         (session_id,)
@@ -159,57 +85,56 @@ def import_session(
     old_branch_ids = [row[0] for row in cursor.fetchall()]
     for bid in old_branch_ids:
         cursor.execute("DELETE FROM branch_messages WHERE branch_id = ?", (bid,))
+    delete_branch_lists(conn, old_branch_ids)
     cursor.execute("DELETE FROM branches WHERE session_id = ?", (session_id,))
 
-    branches_imported = 0
-
-    for branch in branches:
-        leaf_uuid = branch["leaf_uuid"]
-        branch_uuids = branch["uuids"]
-        is_active = branch["is_active"]
-        fork_point_uuid = branch.get("fork_point_uuid")
+    # Step 3: Insert ALL messages once (delete + reinsert for re-import)
+    cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
 
-        # Filter messages to this branch
-        branch_msgs = [m for m in messages if m.get("uuid") in branch_uuids]
-        branch_msgs.sort(key=lambda e: e.get("timestamp") or "")
+    rows = [(session_id, *row) for row in parsed.messages]
+    total_messages = bulk_insert_messages(conn, rows)
 
-        if not branch_msgs:
-            continue
+    # Step 4: Build uuid -> message_id mapping
+    # Rows stream straight from the cursor into the dict, no fetchall() list
+    cursor.execute(
+        "SELECT uuid, id FROM messages WHERE session_id = ? AND uuid IS NOT NULL",
+        (session_id,)
+    )
+    uuid_to_msg_id = dict(cursor)
 
-        # Compute branch metadata
-        branch_meta = extract_session_metadata(branch_msgs)
-        exchange_count, files, commits = compute_branch_metadata(branch_msgs)
+    # Step 5: Insert branches + branch_messages
+    branches_imported = 0
+    branch_messages = BatchedWriter(conn, BRANCH_MESSAGE_INSERT_SQL)
 
+    for branch in parsed.branches:
         # Insert branch
         cursor.execute("""
             INSERT INTO branches (session_id, leaf_uuid, fork_point_uuid, is_active,
-                                  started_at, ended_at, exchange_count, files_modified, commits)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                  started_at, ended_at, exchange_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             RETURNING id
         """, (
             session_id,
-            leaf_uuid,
-            fork_point_uuid,
-            int(is_active),
-            branch_meta["started_at"],
-            branch_meta["ended_at"],
-            exchange_count,
-            json.dumps(files) if files else None,
-            json.dumps(commits) if commits else None
+            branch["leaf_uuid"],
+            branch["fork_point_uuid"],
+            int(branch["is_active"]),
+            branch["started_at"],
+            branch["ended_at"],
+            branch["exchange_count"]
         ))
         branch_db_id = cursor.fetchone()[0]
+        replace_branch_lists(conn, branch_db_id, branch["files"], branch["commits"])
 
-        # Insert branch_messages mapping
-        for uuid in branch_uuids:
+        # Queue branch_messages mapping
+        for uuid in branch["uuids"]:
             msg_id = uuid_to_msg_id.get(uuid)
             if msg_id:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO branch_messages (branch_id, message_id) VALUES (?, ?)",
-                    (branch_db_id, msg_id)
-                )
+                branch_messages.add((branch_db_id, msg_id))
 
         branches_imported += 1
 
+    branch_messages.flush()
+
     # Clean up orphaned messages (not referenced by any branch)
     cursor.execute("""
         DELETE FROM messages
@@ -220,17 +145,14 @@ def import_session(
         )
     """, (session_id, session_id))
 
-    # Step 5: Update import_log
-    if log_row:
-        cursor.execute(
-            "UPDATE import_log SET file_hash = ?, imported_at = CURRENT_TIMESTAMP, messages_imported = ? WHERE file_path = ?",
-            (file_hash, total_messages, str(filepath))
-        )
-    else:
-        cursor.execute(
-            "INSERT INTO import_log (file_path, file_hash, messages_imported) VALUES (?, ?, ?)",
-            (str(filepath), file_hash, total_messages)
-        )
+    # Step 6: Update import_log
+    cursor.execute("""
+        INSERT INTO import_log (file_path, file_hash, messages_imported) VALUES (?, ?, ?)
+        ON CONFLICT(file_path) DO UPDATE SET
+            file_hash = excluded.file_hash,
+            imported_at = CURRENT_TIMESTAMP,
+            messages_imported = excluded.messages_imported
+    """, (str(filepath), parsed.file_hash, total_messages))
 
     return branches_imported, total_messages
 
@@ -238,10 +160,16 @@ def import_session(
 def import_project(
     conn: sqlite3.Connection,
     project_dir: Path,
-    exclude_projects: list[str] | None = None
+    exclude_projects: list[str] | None = None,
+    known_hashes: dict[str, str] | None = None,
+    parse_map: ParseMap = map,
+    bulk: Optional[BulkImport] = None
 ) -> tuple[int, int, int]:
     """
     Import all sessions from a project directory.
+    Files are parsed through parse_map (possibly in worker processes) and
+    written here in order, so a session row exists before its subagents.
+    bulk, if given, is marked as soon as any session's messages are rewritten.
     Returns: (sessions_imported, messages_imported, sessions_skipped)
     """
     cursor = conn.cursor()
@@ -261,42 +189,50 @@ def import_project(
     """, (project_path, project_key, project_name))
     project_id = cursor.fetchone()[0]
 
-    sessions_imported = 0
-    messages_imported = 0
-    sessions_skipped = 0
-
+    # Sessions, each followed by its subagents (which name it as parent)
+    files: list[tuple[Path, Optional[str]]] = []
     for jsonl_file in project_dir.glob("*.jsonl"):
         if jsonl_file.name.startswith("."):
             continue
+        files.append((jsonl_file, None))
 
-        branches_count, msg_count = import_session(conn, jsonl_file, project_id)
-        if branches_count == -1:
-            sessions_skipped += 1
-        else:
-            sessions_imported += branches_count
-            messages_imported += msg_count
-
-        # Check for subagents
         session_uuid = jsonl_file.stem
         subagents_dir = project_dir / session_uuid / "subagents"
         if subagents_dir.exists():
             for subagent_file in subagents_dir.glob("*.jsonl"):
-                # For subagents, find parent session id
-                cursor.execute(
-                    "SELECT id FROM sessions WHERE uuid = ? LIMIT 1",
-                    (session_uuid,)
-                )
-                parent_row = cursor.fetchone()
-                parent_sid = parent_row[0] if parent_row else None
+                files.append((subagent_file, session_uuid))
 
-                sub_branches, sub_msg_count = import_session(
-                    conn, subagent_file, project_id, parent_session_id=parent_sid
-                )
-                if sub_branches != -1:
-                    sessions_imported += sub_branches
-                    messages_imported += sub_msg_count
-                else:
-                    sessions_skipped += 1
+    known_hashes = known_hashes or {}
+    paths = [path for path, _ in files]
+    parsed_files = parse_map(parse_session_file, paths, [known_hashes.get(str(p)) for p in paths])
+
+    sessions_imported = 0
+    messages_imported = 0
+    sessions_skipped = 0
+
+    for (path, parent_uuid), parsed in zip(files, parsed_files):
+        if parsed is None:
+            sessions_skipped += 1
+            continue
+
+        parent_sid = None
+        if parent_uuid:
+            # For subagents, find parent session id
+            cursor.execute(
+                "SELECT id FROM sessions WHERE uuid = ? LIMIT 1",
+                (parent_uuid,)
+            )
+            parent_row = cursor.fetchone()
+            parent_sid = parent_row[0] if parent_row else None
+
+        if bulk is not None:
+            # Even a session with no branches has its messages replaced
+            bulk.messages_written = True
+        branches_count, msg_count = import_session(
+            conn, parsed, path, project_id, parent_session_id=parent_sid
+        )
+        sessions_imported += branches_count
+        messages_imported += msg_count
 
     return sessions_imported, messages_imported, sessions_skipped
 
@@ -338,6 +274,17 @@ def main():
         action="store_true",
         help="Show database statistics"
     )
+    parser.add_argument(
+        "--upgrade",
+        action="store_true",
+        help="Only upgrade the database schema if it is outdated"
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes for parsing session files (default: CPU count, 1 = no pool)"
+    )
 
     args = parser.parse_args()
 
@@ -350,6 +297,10 @@ def main():
     # Use get_db_connection which handles migration
     conn = get_db_connection(settings)
 
+    if args.upgrade:
+        close_db_connection(conn)
+        return
+
     if args.stats:
         cursor = conn.cursor()
         cursor.execute("SELECT COUNT(*) FROM projects")
@@ -377,8 +328,10 @@ def main():
 
     if args.search:
         cursor = conn.cursor()
-        terms = args.search.split()
-        fts_query = " OR ".join(f'"{term}"' for term in terms)
+        fts_query = build_fts_query(args.search)
+        if not fts_query:
+            print("No results found.")
+            return
 
         sql = """
             SELECT
@@ -417,37 +370,46 @@ def main():
         print(f"Found {len(results)} results")
         return
 
-    # Import mode
+    # Import mode: one transaction, FTS indexed once at the end instead of per row
     total_sessions = 0
     total_messages = 0
     total_skipped = 0
 
-    if args.project:
-        project_dir = args.projects_dir / args.project
-        if not project_dir.exists():
-            print(f"Project not found: {project_dir}")
-            return
+    known_hashes = dict(conn.execute("SELECT file_path, file_hash FROM import_log"))
+    pool = ProcessPoolExecutor(max_workers=args.jobs) if args.jobs > 1 else None
+    parse_map = partial(pool.map, chunksize=4) if pool else map
 
-        sessions, messages, skipped = import_project(conn, project_dir, exclude_projects)
-        total_sessions += sessions
-        total_messages += messages
-        total_skipped += skipped
-        print(f"Imported {args.project}: {sessions} branches, {messages} messages")
-    else:
-        for project_dir in args.projects_dir.iterdir():
-            if not project_dir.is_dir() or project_dir.name.startswith("."):
-                continue
-
-            sessions, messages, skipped = import_project(conn, project_dir, exclude_projects)
+    # Workers only parse; every database write stays in this process
+    with bulk_import(conn) as bulk, (pool or nullcontext()):
+        if args.project:
+            project_dir = args.projects_dir / args.project
+            if not project_dir.exists():
+                print(f"Project not found: {project_dir}")
+                return
+
+            sessions, messages, skipped = import_project(
+                conn, project_dir, exclude_projects, known_hashes, parse_map, bulk
+            )
             total_sessions += sessions
             total_messages += messages
             total_skipped += skipped
+            print(f"Imported {args.project}: {sessions} branches, {messages} messages")
+        else:
+            for project_dir in args.projects_dir.iterdir():
+                if not project_dir.is_dir() or project_dir.name.startswith("."):
+                    continue
+
+                sessions, messages, skipped = import_project(
+                    conn, project_dir, exclude_projects, known_hashes, parse_map, bulk
+                )
+                total_sessions += sessions
+                total_messages += messages
+                total_skipped += skipped
 
-            if sessions > 0 or messages > 0:
-                print(f"Imported {project_dir.name}: {sessions} branches, {messages} messages")
+                if sessions > 0 or messages > 0:
+                    print(f"Imported {project_dir.name}: {sessions} branches, {messages} messages")
 
-    conn.commit()
-    conn.close()
+    close_db_connection(conn)
 
     logger.info(f"Import complete: {total_sessions} branches, {total_messages} messages")
     print(f"\nTotal: {total_sessions} branches, {total_messages} messages imported ({total_skipped} unchanged)")
@@ -22,32 +22,40 @@ SCRIPT_DIR = Path(__file__).resolve().parent
 sys.path.insert(0, str(SCRIPT_DIR.parent / "skills" / "past-conversations" / "scripts"))
 
 from memory_utils import (
+    BRANCH_COMMITS_JSON,
+    fetch_branch_messages,
     get_db_path,
     load_settings,
     format_time,
     get_project_key,
+    open_ro,
     setup_logging,
 )
 
+_TOOL_MARKER_RE = re.compile(r'\[Tool: \w+\]')
+
 
 def select_sessions(conn: sqlite3.Connection, project_key: str, current_session_id: str, max_sessions: int) -> list[dict]:
     """
     Select sessions for context using the exchange-count algorithm.
     Returns list of session dicts with messages.
     """
-    cursor = conn.cursor()
-
     # Get project ID
-    cursor.execute("SELECT id FROM projects WHERE key = ?", (project_key,))
-    row = cursor.fetchone()
+    row = conn.execute("SELECT id FROM projects WHERE key = ?", (project_key,)).fetchone()
     if not row:
         return []
     project_id = row[0]
 
-    # Get recent active branches (by last activity), excluding current and subagents
-    cursor.execute("""
+    # Get recent active branches (by last activity), excluding current and subagents.
+    # Only the last 10 modified files are fetched; the rest are summarized by count.
+    candidates = conn.execute(f"""
         SELECT s.id, s.uuid, b.started_at, b.ended_at, b.exchange_count,
-               b.files_modified, b.commits, s.git_branch, b.id as branch_db_id
+               (SELECT json_group_array(path) FROM
+                  (SELECT path FROM
+                     (SELECT ord, path FROM branch_files WHERE branch_id = b.id ORDER BY ord DESC LIMIT 10)
+                   ORDER BY ord)) as recent_files,
+               (SELECT COUNT(*) FROM branch_files WHERE branch_id = b.id) as file_count,
+               {BRANCH_COMMITS_JSON}, s.git_branch, b.id as branch_db_id
         FROM sessions s
         JOIN branches b ON b.session_id = s.id AND b.is_active = 1
         WHERE s.project_id = ?
@@ -57,41 +65,33 @@ def select_sessions(conn: sqlite3.Connection, project_key: str, current_session_
         LIMIT 20
     """, (project_id, current_session_id))
 
-    candidates = cursor.fetchall()
+    # Iterated lazily: selection usually stops after the first few rows
     selected = []
+    selected_branch_ids = []
 
     for session in candidates:
-        _session_id, uuid, started_at, ended_at, exchange_count, files_json, commits_json, git_branch, branch_db_id = session
+        (_session_id, uuid, started_at, ended_at, exchange_count,
+         files_json, file_count, commits_json, git_branch, branch_db_id) = session
 
         # Skip 1-exchange sessions (noise)
         if exchange_count <= 1:
             continue
 
-        # Get messages for this branch via branch_messages
-        cursor.execute("""
-            SELECT m.role, m.content, m.timestamp
-            FROM branch_messages bm
-            JOIN messages m ON bm.message_id = m.id
-            WHERE bm.branch_id = ?
-            ORDER BY m.timestamp ASC
-        """, (branch_db_id,))
-
-        messages = [{"role": r, "content": c, "timestamp": t} for r, c, t in cursor.fetchall()]
-
         session_data = {
             "uuid": uuid,
             "started_at": started_at,
             "ended_at": ended_at,
             "exchange_count": exchange_count,
             "files_modified": json.loads(files_json) if files_json else [],
+            "files_total": file_count,
             "commits": json.loads(commits_json) if commits_json else [],
             "git_branch": git_branch,
-            "messages": messages
         }
 
         # 2-exchange: load it, keep looking unless at limit
         if exchange_count == 2:
             selected.append(session_data)
+            selected_branch_ids.append(branch_db_id)
             if len(selected) >= max_sessions:
                 break
             continue
@@ -99,8 +99,14 @@ def select_sessions(conn: sqlite3.Connection, project_key: str, current_session_
         # >2 exchanges: load it and stop (sufficient context)
         if exchange_count > 2:
             selected.append(session_data)
+            selected_branch_ids.append(branch_db_id)
             break
 
+    # Messages for all selected branches in one query
+    messages_by_branch = fetch_branch_messages(conn, selected_branch_ids)
+    for session_data, branch_db_id in zip(selected, selected_branch_ids):
+        session_data["messages"] = messages_by_branch[branch_db_id]
+
     return selected
 
 
@@ -121,13 +127,14 @@ def build_context(sessions: list[dict]) -> str:
         lines.append(f"### Session: {start} -> {end}\n")
 
         # Files modified
-        files = session.get("files_modified", [])
+        files = session.get("files_modified", [])  # Last 10
         if files:
             lines.append("### Files Modified")
-            for f in files[-10:]:  # Last 10
+            for f in files:
                 lines.append(f"- `{f}`")
-            if len(files) > 10:
-                lines.append(f"- ...and {len(files) - 10} more")
+            files_total = session.get("files_total", len(files))
+            if files_total > len(files):
+                lines.append(f"- ...and {files_total - len(files)} more")
             lines.append("")
 
         # Git commits
@@ -154,7 +161,7 @@ def build_context(sessions: list[dict]) -> str:
                 current_user = m["content"]
                 current_asst = []
             elif m["role"] == "assistant" and current_user is not None:
-                cleaned = re.sub(r'\[Tool: \w+\]', '', m["content"]).strip()
+                cleaned = _TOOL_MARKER_RE.sub('', m["content"]).strip()
                 if cleaned:
                     current_asst.append(cleaned)
 
@@ -216,7 +223,7 @@ def main():
         return
 
     try:
-        conn = sqlite3.connect(db_path)
+        conn = open_ro(db_path)
         project_key = get_project_key(cwd)
         max_sessions = settings.get("max_context_sessions", 2)
         sessions = select_sessions(conn, project_key, session_id, max_sessions)
@@ -13,6 +13,11 @@ mkdir -p "$HOME/.claude-memory"
 if [ ! -f "$DB_PATH" ]; then
     nohup python3 "$SCRIPT_DIR/import_conversations.py" &>/dev/null &
     disown
+else
+    # Upgrade an outdated schema (a no-op otherwise); readers report it as
+    # pending until this finishes, since they only open the database read-only
+    nohup python3 "$SCRIPT_DIR/import_conversations.py" --upgrade &>/dev/null &
+    disown
 fi
 
 # Create default settings file if missing
@@ -20,16 +20,24 @@ sys.path.insert(0, str(SCRIPT_DIR.parent / "skills" / "past-conversations" / "sc
 
 from memory_utils import (
     DEFAULT_PROJECTS_DIR,
+    compact_fts,
     get_db_connection,
+    close_db_connection,
     load_settings,
     setup_logging,
-    extract_text_content,
-    is_tool_result,
+    parse_project_key,
+    extract_project_name,
+    scan_content,
     parse_jsonl_file,
     parse_all_with_uuids,
     extract_session_metadata,
     find_all_branches,
     compute_branch_metadata,
+    replace_branch_lists,
+    delete_branch_lists,
+    batched_writer,
+    MESSAGE_INSERT_SQL,
+    BRANCH_MESSAGE_INSERT_SQL,
 )
 
 
@@ -65,8 +73,8 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
 
     # Get or create project
     project_key = project_dir.name
-    project_path = "/" + project_key.replace("-", "/").lstrip("/")
-    project_name = Path(project_path).name
+    project_path = parse_project_key(project_key)
+    project_name = extract_project_name(project_path)
 
     cursor.execute("""
         INSERT INTO projects (path, key, name)
@@ -117,54 +125,53 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
         "SELECT uuid FROM messages WHERE session_id = ? AND uuid IS NOT NULL",
         (session_id,)
     )
-    existing_uuids = {row[0] for row in cursor.fetchall()}
-
-    new_count = 0
-    for entry in messages:
-        entry_type = entry.get("type")
-        if entry_type not in ("user", "assistant"):
-            continue
+    existing_uuids = {row[0] for row in cursor}
+
+    content_info = {}
+    with batched_writer(conn, MESSAGE_INSERT_SQL) as writer:
+        for entry in messages:
+            entry_type = entry.get("type")
+            if entry_type not in ("user", "assistant"):
+                continue
+
+            # Already stored: skip before paying for the content scan
+            uuid = entry.get("uuid")
+            if uuid and uuid in existing_uuids:
+                continue
+
+            message = entry.get("message", {})
+            info = scan_content(message.get("content", ""))
+            if uuid:
+                content_info[uuid] = info
 
-        message = entry.get("message", {})
-        content = message.get("content", "")
+            if entry_type == "user" and info.is_tool_result:
+                continue
 
-        if entry_type == "user" and is_tool_result(content):
-            continue
+            if not info.text:
+                continue
 
-        text, has_tool_use, has_thinking, tool_summary = extract_text_content(content)
-        if not text:
-            continue
-
-        uuid = entry.get("uuid")
-        if uuid and uuid in existing_uuids:
-            continue
-
-        cursor.execute("""
-            INSERT INTO messages (session_id, uuid, parent_uuid, timestamp, role, content, tool_summary, has_tool_use, has_thinking)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(session_id, uuid) DO NOTHING
-        """, (
-            session_id,
-            uuid,
-            entry.get("parentUuid"),
-            entry.get("timestamp"),
-            entry_type,
-            text,
-            tool_summary,
-            has_tool_use,
-            has_thinking
-        ))
-        if cursor.rowcount > 0:
-            new_count += 1
+            writer.add((
+                session_id,
+                uuid,
+                entry.get("parentUuid"),
+                entry.get("timestamp"),
+                entry_type,
+                info.text,
+                info.tool_summary,
+                info.has_tool_use,
+                info.has_thinking
+            ))
             if uuid:
                 existing_uuids.add(uuid)
+    new_count = writer.rowcount
 
     # Step 3: Build uuid -> message_id mapping
+    # Rows stream straight from the cursor into the dict, no fetchall() list
     cursor.execute(
-        "SELECT id, uuid FROM messages WHERE session_id = ? AND uuid IS NOT NULL",
+        "SELECT uuid, id FROM messages WHERE session_id = ? AND uuid IS NOT NULL",
         (session_id,)
     )
-    uuid_to_msg_id = {row[1]: row[0] for row in cursor.fetchall()}
+    uuid_to_msg_id = dict(cursor)
 
     # Step 4: Get existing branch leaf_uuids for this session
     cursor.execute(
@@ -188,7 +195,7 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
 
         # Compute branch metadata
         branch_meta = extract_session_metadata(branch_msgs)
-        exchange_count, files, commits = compute_branch_metadata(branch_msgs)
+        exchange_count, files, commits = compute_branch_metadata(branch_msgs, content_info)
 
         if leaf_uuid in existing_branches:
             # Update existing branch
@@ -199,9 +206,7 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
                     fork_point_uuid = ?,
                     started_at = ?,
                     ended_at = ?,
-                    exchange_count = ?,
-                    files_modified = ?,
-                    commits = ?
+                    exchange_count = ?
                 WHERE id = ?
             """, (
                 int(is_active),
@@ -209,16 +214,14 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
                 branch_meta["started_at"],
                 branch_meta["ended_at"],
                 exchange_count,
-                json.dumps(files) if files else None,
-                json.dumps(commits) if commits else None,
                 branch_db_id
             ))
         else:
             # Insert new branch
             cursor.execute("""
                 INSERT INTO branches (session_id, leaf_uuid, fork_point_uuid, is_active,
-                                      started_at, ended_at, exchange_count, files_modified, commits)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                      started_at, ended_at, exchange_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
                 RETURNING id
             """, (
                 session_id,
@@ -227,12 +230,12 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
                 int(is_active),
                 branch_meta["started_at"],
                 branch_meta["ended_at"],
-                exchange_count,
-                json.dumps(files) if files else None,
-                json.dumps(commits) if commits else None
+                exchange_count
             ))
             branch_db_id = cursor.fetchone()[0]
 
+        replace_branch_lists(conn, branch_db_id, files, commits)
+
         # Ensure only one active branch
         if is_active:
             cursor.execute("""
@@ -242,19 +245,15 @@ def sync_session(conn: sqlite3.Connection, filepath: Path, project_dir: Path) ->
 
         # Rebuild branch_messages for this branch
         cursor.execute("DELETE FROM branch_messages WHERE branch_id = ?", (branch_db_id,))
-
-        for uuid in branch_uuids:
-            msg_id = uuid_to_msg_id.get(uuid)
-            if msg_id:
-                cursor.execute(
-                    "INSERT OR IGNORE INTO branch_messages (branch_id, message_id) VALUES (?, ?)",
-                    (branch_db_id, msg_id)
-                )
+        conn.executemany(BRANCH_MESSAGE_INSERT_SQL, [
+            (branch_db_id, uuid_to_msg_id[uuid]) for uuid in branch_uuids if uuid in uuid_to_msg_id
+        ])
 
     # Step 5: Clean up stale branches
     for old_leaf, old_branch_id in existing_branches.items():
         if old_leaf not in current_leaf_uuids:
             cursor.execute("DELETE FROM branch_messages WHERE branch_id = ?", (old_branch_id,))
+            delete_branch_lists(conn, [old_branch_id])
             cursor.execute("DELETE FROM branches WHERE id = ?", (old_branch_id,))
 
     # Clean up orphaned messages (not referenced by any branch)
@@ -310,9 +309,12 @@ def main():
         if project_dir.name == "subagents":
             project_dir = project_dir.parent.parent
 
+        conn.execute("BEGIN IMMEDIATE")
         new_messages = sync_session(conn, session_file, project_dir)
+        if new_messages > 0 and compact_fts(conn, new_messages):
+            logger.info("Optimized FTS index")
         conn.commit()
-        conn.close()
+        close_db_connection(conn)
 
         if new_messages > 0:
             logger.info(f"Synced {new_messages} new message(s) from session {session_id[:8]}")
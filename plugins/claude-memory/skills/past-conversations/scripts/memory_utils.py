@@ -10,14 +10,29 @@ Consolidates common code used across memory scripts:
 - JSONL parsing and branch detection
 """
 
+import atexit
+import hashlib
+import io
 import json
 import logging
+import os
+import queue
 import re
+import shutil
 import sqlite3
-from datetime import datetime
-from logging.handlers import RotatingFileHandler
+import sys
+import textwrap
+import time
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from itertools import chain, compress, groupby
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from operator import itemgetter
 from pathlib import Path
-from typing import Generator, Optional
+from types import MappingProxyType
+from typing import Any, Callable, Generator, Iterable, Mapping, Optional, TextIO
 
 try:
     import yaml
@@ -25,6 +40,12 @@ try:
 except ImportError:
     HAS_YAML = False
 
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 # Default paths
 DEFAULT_DB_PATH = Path.home() / ".claude-memory" / "conversations.db"
 DEFAULT_PROJECTS_DIR = Path.home() / ".claude" / "projects"
@@ -40,6 +61,36 @@ DEFAULT_SETTINGS = {
     "logging_enabled": False,
     "sync_on_stop": True,
 }
+_DEFAULT_SETTINGS_FROZEN = MappingProxyType(DEFAULT_SETTINGS)
+
+# The trigram tokenizer (SQLite 3.34+) matches substrings such as partial
+# identifiers and paths; older SQLite falls back to whole-word porter stemming
+HAS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+FTS_TOKENIZE = "tokenize='trigram'" if HAS_TRIGRAM else "tokenize='porter unicode61', prefix='2 3 4'"
+# Shortest query token the index can match (trigrams need three characters)
+FTS_MIN_TOKEN = 3 if HAS_TRIGRAM else 2
+
+# Connection tuning safe for any connection, including read-only ones
+READ_PRAGMAS = """
+PRAGMA busy_timeout=5000;
+PRAGMA cache_size=-20000;
+PRAGMA temp_store=MEMORY;
+PRAGMA mmap_size=268435456;
+"""
+
+# FTS5 sync triggers, keyed by name so bulk imports can drop and recreate them
+FTS_TRIGGERS = {
+    "messages_ai": """CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+  INSERT INTO messages_fts(rowid, content, session_id) VALUES (new.id, new.content, new.session_id);
+END""",
+    "messages_ad": """CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+  INSERT INTO messages_fts(messages_fts, rowid, content, session_id) VALUES('delete', old.id, old.content, old.session_id);
+END""",
+    "messages_au": """CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+  INSERT INTO messages_fts(messages_fts, rowid, content, session_id) VALUES('delete', old.id, old.content, old.session_id);
+  INSERT INTO messages_fts(rowid, content, session_id) VALUES (new.id, new.content, new.session_id);
+END""",
+}
 
 # Database schema — v3: messages stored once, branches as separate index
 SCHEMA = """
@@ -75,12 +126,27 @@ CREATE TABLE IF NOT EXISTS branches (
   started_at DATETIME,
   ended_at DATETIME,
   exchange_count INTEGER DEFAULT 0,
-  files_modified TEXT,
-  commits TEXT,
   UNIQUE(session_id, leaf_uuid)
 );
 CREATE INDEX IF NOT EXISTS idx_branches_session ON branches(session_id);
-CREATE INDEX IF NOT EXISTS idx_branches_active ON branches(is_active);
+-- (is_active, ended_at) serves the active-branch lookups and their ORDER BY ended_at
+DROP INDEX IF EXISTS idx_branches_active;
+CREATE INDEX IF NOT EXISTS idx_branches_active_ended ON branches(is_active, ended_at);
+
+-- Files modified / commit messages per branch, in order of appearance
+CREATE TABLE IF NOT EXISTS branch_files (
+  branch_id INTEGER NOT NULL REFERENCES branches(id),
+  ord INTEGER NOT NULL,
+  path TEXT NOT NULL,
+  PRIMARY KEY (branch_id, ord)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS branch_commits (
+  branch_id INTEGER NOT NULL REFERENCES branches(id),
+  ord INTEGER NOT NULL,
+  message TEXT NOT NULL,
+  PRIMARY KEY (branch_id, ord)
+) WITHOUT ROWID;
 
 -- Messages table (ALL messages stored ONCE per session)
 CREATE TABLE IF NOT EXISTS messages (
@@ -96,9 +162,12 @@ CREATE TABLE IF NOT EXISTS messages (
   has_thinking INTEGER DEFAULT 0,
   UNIQUE(session_id, uuid)
 );
-CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id);
-CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
-CREATE INDEX IF NOT EXISTS idx_messages_session_uuid ON messages(session_id, uuid);
+-- (session_id, timestamp) also serves plain session_id lookups, and the
+-- UNIQUE(session_id, uuid) constraint already provides that index
+DROP INDEX IF EXISTS idx_messages_session;
+DROP INDEX IF EXISTS idx_messages_timestamp;
+DROP INDEX IF EXISTS idx_messages_session_uuid;
+CREATE INDEX IF NOT EXISTS idx_messages_session_ts ON messages(session_id, timestamp);
 
 -- Branch-messages mapping (many-to-many)
 CREATE TABLE IF NOT EXISTS branch_messages (
@@ -109,23 +178,25 @@ CREATE TABLE IF NOT EXISTS branch_messages (
 CREATE INDEX IF NOT EXISTS idx_branch_messages_message ON branch_messages(message_id);
 
 -- FTS5 full-text search (auto-synced via triggers)
+-- Column sizes are stored (no columnsize=0): bm25 ranking needs them and would
+-- otherwise re-tokenize every matching row; tokenizer options in FTS_TOKENIZE;
+-- session_id is read through without being indexed, so matches need no join
 CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
   content,
+  session_id UNINDEXED,
   content=messages,
   content_rowid=id,
-  tokenize='porter unicode61'
+  """ + FTS_TOKENIZE + """
 );
 
-CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
-  INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
-END;
-CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
-  INSERT INTO messages_fts(messages_fts, rowid, content) VALUES('delete', old.id, old.content);
-END;
-CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
-  INSERT INTO messages_fts(messages_fts, rowid, content) VALUES('delete', old.id, old.content);
-  INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
-END;
+""" + ";\n".join(FTS_TRIGGERS.values()) + """;
+
+-- Maintenance counters (e.g. inserts since the last FTS optimize) and flags
+-- (fts_trigram: 1 if messages_fts uses the trigram tokenizer)
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value INTEGER NOT NULL DEFAULT 0
+);
 
 -- Import tracking
 CREATE TABLE IF NOT EXISTS import_log (
@@ -144,13 +215,59 @@ FROM messages m JOIN sessions s ON m.session_id = s.id JOIN projects p ON s.proj
 CREATE VIEW IF NOT EXISTS recent_conversations AS
 SELECT s.uuid as session_uuid, b.leaf_uuid as branch_id, b.is_active as is_active_branch,
        p.name as project, b.started_at, b.ended_at,
-       b.exchange_count, b.files_modified, b.commits, s.git_branch
+       b.exchange_count,
+       (SELECT json_group_array(path) FROM
+          (SELECT path FROM branch_files WHERE branch_id = b.id ORDER BY ord)) as files_modified,
+       (SELECT json_group_array(message) FROM
+          (SELECT message FROM branch_commits WHERE branch_id = b.id ORDER BY ord)) as commits,
+       s.git_branch
 FROM sessions s
 JOIN branches b ON b.session_id = s.id
 JOIN projects p ON s.project_id = p.id
 ORDER BY b.ended_at DESC;
 """
 
+# Stored in PRAGMA user_version once SCHEMA and all migrations have been applied;
+# bump it whenever SCHEMA or a migration changes
+SCHEMA_VERSION = 7
+
+# Branch file/commit lists as JSON arrays, for queries that alias branches as b
+BRANCH_FILES_JSON = (
+    "(SELECT json_group_array(path) FROM "
+    "(SELECT path FROM branch_files WHERE branch_id = b.id ORDER BY ord))"
+)
+BRANCH_COMMITS_JSON = (
+    "(SELECT json_group_array(message) FROM "
+    "(SELECT message FROM branch_commits WHERE branch_id = b.id ORDER BY ord))"
+)
+
+
+_QUERY_TOKEN_RE = re.compile(r"\w+")
+
+
+def build_fts_query(query: str) -> str:
+    """
+    Turn free text into an FTS5 MATCH expression: word tokens of at least
+    FTS_MIN_TOKEN characters, each quoted as a phrase and OR-ed. With the
+    trigram tokenizer a phrase matches anywhere inside a word. Punctuation and
+    quotes are dropped so user input cannot produce FTS5 syntax errors.
+    Returns "" when the query has no usable tokens.
+    """
+    tokens = dict.fromkeys(
+        t for t in _QUERY_TOKEN_RE.findall(query.lower()) if len(t) >= FTS_MIN_TOKEN
+    )
+    return " OR ".join(f'"{t}"' for t in tokens)
+
+
+def in_list(values: list, size: int = 4) -> tuple[str, list]:
+    """
+    Placeholders and params for an IN (...) list, padded with NULLs to a
+    multiple of size so the SQL text stays the same across calls and its
+    prepared statement is reused. NULL never matches, so results are unchanged.
+    """
+    padded = size * max(1, -(-len(values) // size))
+    return ",".join("?" * padded), [*values, *[None] * (padded - len(values))]
+
 
 def migrate_db(conn: sqlite3.Connection) -> bool:
     """
@@ -196,19 +313,19 @@ def migrate_db(conn: sqlite3.Connection) -> bool:
     return True
 
 
-def load_settings(settings_path: Optional[Path] = None) -> dict:
+@lru_cache(maxsize=4)
+def load_settings(settings_path: Optional[Path] = None) -> Mapping[str, Any]:
     """
     Load settings from YAML frontmatter in settings file.
     Returns default settings if file doesn't exist or parsing fails.
+    Cached per path for the life of the process; see invalidate_settings_cache().
+    The result is a read-only view since every caller shares the cached copy.
     """
     path = settings_path or DEFAULT_SETTINGS_PATH
-    settings = DEFAULT_SETTINGS.copy()
+    settings = dict(_DEFAULT_SETTINGS_FROZEN)
 
-    if not path.exists():
-        return settings
-
-    if not HAS_YAML:
-        return settings
+    if not path.exists() or not HAS_YAML:
+        return MappingProxyType(settings)
 
     try:
         content = path.read_text()
@@ -222,10 +339,15 @@ def load_settings(settings_path: Optional[Path] = None) -> dict:
     except Exception:
         pass
 
-    return settings
+    return MappingProxyType(settings)
+
 
+def invalidate_settings_cache() -> None:
+    """Forget cached settings so the next load_settings() re-reads the file."""
+    load_settings.cache_clear()
 
-def get_db_path(settings: Optional[dict] = None) -> Path:
+
+def get_db_path(settings: Optional[Mapping[str, Any]] = None) -> Path:
     """Get database path from settings or default."""
     if settings and "db_path" in settings:
         return Path(settings["db_path"]).expanduser()
@@ -239,41 +361,368 @@ def _migrate_columns(conn: sqlite3.Connection) -> None:
     existing = {row[1] for row in cursor.fetchall()}
     if "tool_summary" not in existing:
         cursor.execute("ALTER TABLE messages ADD COLUMN tool_summary TEXT")
-        conn.commit()
 
 
-def get_db_connection(settings: Optional[dict] = None) -> sqlite3.Connection:
+def _backfill_branch_lists(conn: sqlite3.Connection) -> None:
+    """
+    Move files_modified/commits JSON columns of pre-existing branches into
+    branch_files/branch_commits. The old columns are cleared, not dropped.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(branches)")}
+    if "files_modified" not in existing:
+        return
+    conn.execute("""
+        INSERT OR IGNORE INTO branch_files (branch_id, ord, path)
+        SELECT b.id, j.key, j.value FROM branches b, json_each(b.files_modified) j
+        WHERE b.files_modified IS NOT NULL
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO branch_commits (branch_id, ord, message)
+        SELECT b.id, j.key, j.value FROM branches b, json_each(b.commits) j
+        WHERE b.commits IS NOT NULL
+    """)
+    conn.execute("""
+        UPDATE branches SET files_modified = NULL, commits = NULL
+        WHERE files_modified IS NOT NULL OR commits IS NOT NULL
+    """)
+
+
+def _drop_outdated_fts(conn: sqlite3.Connection) -> bool:
+    """
+    Drop messages_fts (and its triggers) if it was created with older options.
+    Returns True if the FTS table must be initialized after the schema is applied,
+    which includes a current table left empty while messages has rows.
+    """
+    row = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+    if (row and FTS_TOKENIZE in row[0] and "session_id UNINDEXED" in row[0]
+            and "columnsize" not in row[0]):
+        return conn.execute("""
+            SELECT EXISTS (SELECT 1 FROM messages)
+               AND NOT EXISTS (SELECT 1 FROM messages_fts_docsize)
+        """).fetchone()[0] == 1
+    if row:
+        for name in FTS_TRIGGERS:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute("DROP TABLE messages_fts")
+    return True
+
+
+def _init_fts(conn: sqlite3.Connection) -> None:
+    """Configure a newly created FTS table and index any existing messages."""
+    conn.execute("INSERT INTO messages_fts(messages_fts, rank) VALUES('pgsz', 4096)")
+    conn.execute("INSERT INTO messages_fts(messages_fts, rank) VALUES('automerge', 8)")
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES('rebuild')")
+
+
+def _check_fts_tokenizer(conn: sqlite3.Connection) -> None:
+    """
+    Raise if messages_fts was built with the trigram tokenizer but this SQLite
+    lacks it: every FTS access would fail, the sync triggers included. The
+    choice is stamped in meta; databases from before that are checked by their
+    table definition.
+    """
+    if HAS_TRIGRAM:
+        return
+    try:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'fts_trigram'").fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT instr(sql, 'trigram') > 0 FROM sqlite_master WHERE name = 'messages_fts'"
+            ).fetchone()
+    except sqlite3.OperationalError:
+        return  # No schema yet
+    if row and row[0]:
+        raise sqlite3.OperationalError(
+            "Search index uses the trigram tokenizer, which needs SQLite 3.34+ "
+            f"(this python3 has {sqlite3.sqlite_version}); run with a newer python3 "
+            "or delete the database to re-import it"
+        )
+
+
+def _configure_connection(conn: sqlite3.Connection, db_path: Path) -> None:
+    """Apply WAL journaling and the write-side PRAGMAs on top of READ_PRAGMAS."""
+    if str(db_path) != ":memory:":
+        # Journal mode is persistent; only switch when not already WAL
+        mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        if mode.lower() != "wal":
+            conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(READ_PRAGMAS + """
+        PRAGMA synchronous=NORMAL;
+        PRAGMA foreign_keys=ON;
+        PRAGMA wal_autocheckpoint=1000;
+    """)
+
+
+def _schema_statements(script: str) -> Generator[str, None, None]:
+    """Split a SQL script into complete statements, trigger bodies included."""
+    statement = ""
+    for line in script.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ""
+
+
+def _apply_schema(conn: sqlite3.Connection) -> None:
+    """
+    Create or upgrade all tables, indexes and triggers, then stamp SCHEMA_VERSION.
+    Everything runs in one BEGIN IMMEDIATE transaction, statement by statement
+    since executescript() would commit first: an interrupted upgrade is rolled
+    back and retried in full, never left stamped over a half-built FTS index.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have finished the upgrade while we waited
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            conn.execute("COMMIT")
+            return
+
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "branches" in tables and "branch_files" not in tables:
+            # View is redefined on top of branch_files/branch_commits
+            conn.execute("DROP VIEW IF EXISTS recent_conversations")
+        init_fts = _drop_outdated_fts(conn)
+        for statement in _schema_statements(SCHEMA):
+            conn.execute(statement)
+        if init_fts:
+            _init_fts(conn)
+        conn.execute("""
+            INSERT INTO meta (key, value) VALUES ('fts_trigram', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+        """, (int(HAS_TRIGRAM),))
+        _backfill_branch_lists(conn)
+
+        # Add any missing columns (e.g. tool_summary)
+        _migrate_columns(conn)
+
+        conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def get_db_connection(settings: Optional[Mapping[str, Any]] = None) -> sqlite3.Connection:
     """
     Get database connection, initializing schema and running migrations if needed.
     Uses settings-based path if provided.
+
+    The connection is in autocommit mode (isolation_level=None): writers wrap
+    their work in an explicit BEGIN IMMEDIATE ... COMMIT so a whole sync or
+    import is one transaction instead of relying on implicit transactions.
     """
     db_path = get_db_path(settings)
     db_path.parent.mkdir(parents=True, exist_ok=True)
     conn = sqlite3.connect(db_path)
+    _check_fts_tokenizer(conn)
+
+    # Schema and migrations only run when the stored version is stale
+    up_to_date = conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
 
     # Check if migration needed (old schema -> v3)
-    migrated = migrate_db(conn)
-    if migrated:
+    if not up_to_date and migrate_db(conn):
         # Connection was closed during migration, reconnect
         conn = sqlite3.connect(db_path)
-    else:
-        # Apply schema (handles fresh databases, idempotent)
-        conn.executescript(SCHEMA)
-        conn.commit()
 
-    # Add any missing columns (e.g. tool_summary)
-    _migrate_columns(conn)
+    conn.isolation_level = None
+    _configure_connection(conn, db_path)
+
+    if not up_to_date:
+        _apply_schema(conn)
 
     return conn
 
 
-def setup_logging(settings: Optional[dict] = None) -> logging.Logger:
+def open_ro(db_path: Path) -> sqlite3.Connection:
+    """
+    Open the database read-only for the query scripts, with rows as sqlite3.Row.
+    A mode=ro connection never takes a write lock against a concurrent sync.
+    Not immutable=1: the database is in WAL mode and may be written meanwhile.
+    Never upgrades: an older schema version raises sqlite3.OperationalError until
+    the background setup or sync has upgraded it, since the queries rely on the
+    current tables and FTS columns. So does an FTS tokenizer this SQLite lacks.
+    """
+    uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+    conn = sqlite3.connect(uri, uri=True)
+    _check_fts_tokenizer(conn)
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        conn.close()
+        raise sqlite3.OperationalError(
+            "Database upgrade pending; it runs in the background at the next session start"
+        )
+    conn.executescript(READ_PRAGMAS + """
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=536870912;
+        PRAGMA query_only=1;
+    """)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def close_db_connection(conn: sqlite3.Connection) -> None:
+    """Close a write connection, letting SQLite refresh planner statistics first."""
+    conn.execute("PRAGMA optimize")
+    conn.close()
+
+
+def pause_fts(conn: sqlite3.Connection) -> None:
+    """Drop the FTS sync triggers so message writes skip per-row tokenization."""
+    for name in FTS_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def resume_fts(conn: sqlite3.Connection, rebuild: bool = True) -> None:
+    """Recreate the FTS sync triggers, first re-indexing all messages in one pass."""
+    if rebuild:
+        conn.execute("INSERT INTO messages_fts(messages_fts) VALUES('rebuild')")
+    for trigger_sql in FTS_TRIGGERS.values():
+        conn.execute(trigger_sql)
+
+
+@dataclass(slots=True)
+class BulkImport:
+    """Progress of a bulk_import block; the caller sets messages_written."""
+    messages_written: bool = False
+
+
+@contextmanager
+def bulk_import(conn: sqlite3.Connection) -> Generator[BulkImport, None, None]:
+    """
+    Run a bulk import as one BEGIN IMMEDIATE transaction with FTS paused.
+    On success, if the caller marked messages as written, the index is rebuilt
+    and planner statistics refreshed before the transaction is committed; on
+    error it is rolled back, triggers included.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        pause_fts(conn)
+        state = BulkImport()
+        yield state
+        resume_fts(conn, rebuild=state.messages_written)
+        if state.messages_written:
+            # Sampled so large databases stay quick to analyze
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def replace_branch_lists(
+    conn: sqlite3.Connection, branch_id: int, files: list[str], commits: list[str]
+) -> None:
+    """Store a branch's modified files and commit messages, replacing any existing rows."""
+    delete_branch_lists(conn, [branch_id])
+    conn.executemany(
+        "INSERT INTO branch_files (branch_id, ord, path) VALUES (?, ?, ?)",
+        [(branch_id, i, path) for i, path in enumerate(files)]
+    )
+    conn.executemany(
+        "INSERT INTO branch_commits (branch_id, ord, message) VALUES (?, ?, ?)",
+        [(branch_id, i, message) for i, message in enumerate(commits)]
+    )
+
+
+def delete_branch_lists(conn: sqlite3.Connection, branch_ids: list[int]) -> None:
+    """Remove stored files/commits for branches about to be deleted or rewritten."""
+    params = [(bid,) for bid in branch_ids]
+    conn.executemany("DELETE FROM branch_files WHERE branch_id = ?", params)
+    conn.executemany("DELETE FROM branch_commits WHERE branch_id = ?", params)
+
+
+BRANCH_MESSAGE_INSERT_SQL = "INSERT OR IGNORE INTO branch_messages (branch_id, message_id) VALUES (?, ?)"
+
+MESSAGE_INSERT_SQL = """
+    INSERT INTO messages (session_id, uuid, parent_uuid, timestamp, role, content, tool_summary, has_tool_use, has_thinking)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(session_id, uuid) DO NOTHING
+"""
+
+
+def bulk_insert_messages(conn: sqlite3.Connection, rows: Iterable[tuple]) -> int:
+    """
+    Insert message rows (MESSAGE_INSERT_SQL column order) with one executemany.
+    Returns the number of rows actually inserted.
+    """
+    return conn.executemany(MESSAGE_INSERT_SQL, rows).rowcount
+
+
+class BatchedWriter:
+    """Collects parameter tuples for one statement and writes them with executemany."""
+
+    def __init__(self, conn: sqlite3.Connection, sql: str, batch_size: int = 5000):
+        self.conn = conn
+        self.sql = sql
+        self.batch_size = batch_size
+        self.rows: list[tuple] = []
+        self.rowcount = 0
+
+    def add(self, row: tuple) -> None:
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.rows:
+            self.rowcount += self.conn.executemany(self.sql, self.rows).rowcount
+            self.rows = []
+
+
+@contextmanager
+def batched_writer(
+    conn: sqlite3.Connection, sql: str, batch_size: int = 5000
+) -> Generator[BatchedWriter, None, None]:
+    """Yield a BatchedWriter for `sql`, flushing remaining rows on exit."""
+    writer = BatchedWriter(conn, sql, batch_size)
+    yield writer
+    writer.flush()
+
+
+def compact_fts(conn: sqlite3.Connection, inserted: int, threshold: int = 1000) -> bool:
+    """
+    Count inserted messages and optimize the FTS index once every `threshold`
+    inserts, merging its segments into one.
+    Returns True if an optimize ran. The caller commits.
+    """
+    conn.execute("""
+        INSERT INTO meta (key, value) VALUES ('fts_inserts', ?)
+        ON CONFLICT(key) DO UPDATE SET value = value + excluded.value
+    """, (inserted,))
+    count = conn.execute("SELECT value FROM meta WHERE key = 'fts_inserts'").fetchone()[0]
+    if count < threshold:
+        return False
+    conn.execute("INSERT INTO messages_fts(messages_fts) VALUES('optimize')")
+    conn.execute("UPDATE meta SET value = 0 WHERE key = 'fts_inserts'")
+    return True
+
+
+_log_listener: Optional[QueueListener] = None
+
+
+def _stop_log_listener() -> None:
+    """Flush queued log records and stop the background writer thread."""
+    global _log_listener
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+
+atexit.register(_stop_log_listener)
+
+
+def setup_logging(settings: Optional[Mapping[str, Any]] = None) -> logging.Logger:
     """
     Set up logging with rotation.
     Returns a null logger if logging is disabled.
+
+    Records go through a queue to a background listener thread, so callers
+    never block on the file write or rotation check.
     """
+    global _log_listener
     logger = logging.getLogger("claude-memory")
     logger.handlers = []  # Clear existing handlers
+    _stop_log_listener()
 
     if not settings or not settings.get("logging_enabled", False):
         logger.addHandler(logging.NullHandler())
@@ -292,39 +741,63 @@ def setup_logging(settings: Optional[dict] = None) -> logging.Logger:
         datefmt="%Y-%m-%d %H:%M:%S"
     )
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, handler)
+    _log_listener.start()
     logger.setLevel(logging.INFO)
 
     return logger
 
 
+# Local zone resolved once when it is a fixed offset. Zones with DST keep None so
+# astimezone() still picks the right offset for each timestamp.
+_LOCAL_TZ = None if time.daylight else timezone(timedelta(seconds=-time.timezone))
+
+# The formats used in output are slices of isoformat(" ", "minutes"), which
+# avoids strftime()'s locale handling; the UTC offset suffix is cut off.
+_ISO_SLICES = {"%H:%M": slice(11, 16), "%Y-%m-%d %H:%M": slice(0, 16)}
+
+
+@lru_cache(maxsize=4096)
 def format_time(ts_str: Optional[str], fmt: str = "%H:%M") -> str:
     """
     Format ISO timestamp to specified format.
     Default: HH:MM
+    Cached: messages in a session repeat timestamps.
     """
     if not ts_str:
         return "??:??"
     try:
-        dt = datetime.fromisoformat(ts_str.replace('Z', '+00:00'))
-        return dt.astimezone().strftime(fmt)
+        dt = datetime.fromisoformat(ts_str.replace('Z', '+00:00')).astimezone(_LOCAL_TZ)
+        iso_slice = _ISO_SLICES.get(fmt)
+        if iso_slice is not None:
+            return dt.isoformat(" ", "minutes")[iso_slice]
+        return dt.strftime(fmt)
     except Exception:
         return ts_str[:16] if ts_str else "??:??"
 
 
+@lru_cache(maxsize=4096)
 def format_time_full(ts_str: Optional[str]) -> str:
     """Format ISO timestamp to YYYY-MM-DD HH:MM."""
     return format_time(ts_str, "%Y-%m-%d %H:%M")
 
 
+# Single-pass character maps for project key conversion
+_KEY_TRANS = str.maketrans({"/": "-", ".": "-"})
+_PATH_TRANS = str.maketrans({"-": "/"})
+
+
 def get_project_key(cwd: str) -> str:
     """Convert working directory to project key format."""
-    return cwd.replace("/", "-").replace(".", "-")
+    return cwd.translate(_KEY_TRANS)
 
 
 def parse_project_key(key: str) -> str:
     """Convert directory key back to original path."""
-    return "/" + key.replace("-", "/").lstrip("/")
+    return "/" + key.translate(_PATH_TRANS).lstrip("/")
 
 
 def extract_project_name(path: str) -> str:
@@ -332,152 +805,535 @@ def extract_project_name(path: str) -> str:
     return Path(path).name
 
 
-def format_markdown_session(session: dict, verbose: bool = False) -> str:
-    """Format a single session as markdown."""
-    lines = []
+def fetch_branch_messages(conn: sqlite3.Connection, branch_ids: list[int]) -> dict[int, list[sqlite3.Row]]:
+    """
+    Fetch the messages of several branches with a single query.
+    Returns {branch_id: [Row("branch_id", "role", "content", "timestamp"), ...]}
+    in timestamp order; rows are used as-is rather than copied into dicts, so
+    they also carry the branch_id they were grouped by.
+    """
+    result: dict[int, list[sqlite3.Row]] = {bid: [] for bid in branch_ids}
+    if not branch_ids:
+        return result
+
+    placeholders, params = in_list(branch_ids)
+    cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    rows = cursor.execute(f"""
+        SELECT bm.branch_id, m.role, m.content, m.timestamp
+        FROM branch_messages bm
+        JOIN messages m ON bm.message_id = m.id
+        WHERE bm.branch_id IN ({placeholders})
+        ORDER BY bm.branch_id, m.timestamp ASC
+    """, params)
+
+    for branch_id, group in groupby(rows, key=itemgetter(0)):
+        result[branch_id] = list(group)
+    return result
+
+
+def stream_branch_messages(
+    conn: sqlite3.Connection, branch_ids: list[int]
+) -> list[Generator[dict, None, None]]:
+    """
+    Messages of several branches from a single query, as one lazy iterator per
+    branch (in branch_ids order) yielding {"role", "content", "timestamp"} in
+    timestamp order. Rows are read in batches, so no session is held in memory
+    whole. The iterators share one cursor: consume them in order; rows of an
+    iterator that is skipped or left unfinished are passed over.
+    """
+    cursor = conn.execute("""
+        SELECT sel.key, m.role, m.content, m.timestamp
+        FROM json_each(?) sel
+        JOIN branch_messages bm ON bm.branch_id = sel.value
+        JOIN messages m ON bm.message_id = m.id
+        ORDER BY sel.key, m.timestamp ASC
+    """, (json.dumps(branch_ids),))
+    rows = chain.from_iterable(iter(lambda: cursor.fetchmany(256), []))
+    # One row of lookahead, shared by all iterators
+    pending = [next(rows, None)]
+
+    def branch_messages(pos: int) -> Generator[dict, None, None]:
+        while (row := pending[0]) is not None and row[0] <= pos:
+            pending[0] = next(rows, None)
+            if row[0] == pos:
+                yield {"role": row[1], "content": row[2], "timestamp": row[3]}
+
+    return [branch_messages(pos) for pos in range(len(branch_ids))]
+
+
+def search_sessions(
+    conn: sqlite3.Connection,
+    query: str,
+    max_results: int = 5,
+    projects: Optional[list[str]] = None,
+    verbose: bool = False
+) -> list[dict]:
+    """
+    Find sessions containing query terms, most relevant first.
+    Session details are fetched with the ranking; each session's messages are
+    a lazy iterator (see stream_branch_messages), so consume them in order
+    before closing conn.
+    """
+    fts_query = build_fts_query(query)
+    if not fts_query:
+        return []
+
+    # Rank matching sessions by their best-scoring message (the FTS5 rank
+    # column is bm25, lower is better; bm25() itself cannot be used inside an
+    # aggregate). The project filter is applied to the hits before they are
+    # ranked and limited, so other projects' hits cannot crowd it out.
+    project_filter = ""
+    params = [fts_query]
+    if projects:
+        placeholders, project_params = in_list(projects)
+        project_filter = f"""
+              AND session_id IN (
+                SELECT s.id FROM sessions s
+                JOIN projects p ON s.project_id = p.id
+                WHERE p.name IN ({placeholders}))"""
+        params.extend(project_params)
+    params.append(max_results)
+
+    # Files and commits are only selected when they will be shown
+    verbose_cols = f", {BRANCH_FILES_JSON}, {BRANCH_COMMITS_JSON}" if verbose else ""
+    sql = f"""
+        WITH fts_hits AS (
+            SELECT session_id, MIN(rank) AS score
+            FROM messages_fts
+            WHERE messages_fts MATCH ?{project_filter}
+            GROUP BY session_id
+            ORDER BY score
+            LIMIT ?
+        )
+        SELECT s.uuid, b.started_at, b.ended_at, s.git_branch, p.name as project,
+               b.id as branch_id{verbose_cols}
+        FROM fts_hits h
+        JOIN sessions s ON s.id = h.session_id
+        JOIN branches b ON b.session_id = s.id AND b.is_active = 1
+        JOIN projects p ON s.project_id = p.id
+        ORDER BY h.score
+    """
+    # At most max_results rows; their messages are streamed from one query
+    rows = conn.execute(sql, params).fetchall()
+    message_streams = stream_branch_messages(conn, [row[5] for row in rows])
+
+    sessions = []
+    for row, messages in zip(rows, message_streams):
+        uuid, started_at, ended_at, git_branch, project, _branch_id = row[:6]
 
+        session_data = {
+            "uuid": uuid,
+            "project": project,
+            "started_at": started_at,
+            "ended_at": ended_at,
+            "git_branch": git_branch,
+            "messages": messages
+        }
+
+        if verbose:
+            files_json, commits_json = row[6:]
+            # Already JSON arrays; passed through to the output unparsed
+            session_data["files_modified"] = RawJSON(files_json or "[]")
+            session_data["commits"] = RawJSON(commits_json or "[]")
+
+        sessions.append(session_data)
+
+    return sessions
+
+
+_ROLE_LABEL = {"user": "User", "assistant": "Assistant"}
+
+
+def iter_markdown_session(session: dict, verbose: bool = False) -> Generator[str, None, None]:
+    """Yield a single session as markdown, one line at a time (without newlines)."""
     started = format_time_full(session.get("started_at"))
     project = session.get("project", "Unknown")
-    lines.append(f"## {project} | {started}")
-    lines.append(f"Session: {session.get('uuid', 'unknown')[:8]}")
+    yield f"## {project} | {started}"
+    yield f"Session: {session.get('uuid', 'unknown')[:8]}"
 
     if session.get("git_branch"):
-        lines.append(f"Branch: {session['git_branch']}")
+        yield f"Branch: {session['git_branch']}"
 
     if verbose:
-        files = session.get("files_modified", [])
+        files = _load_raw(session.get("files_modified", []))
         if files:
-            lines.append("\n### Files Modified")
+            yield "\n### Files Modified"
             for f in files[-10:]:
-                lines.append(f"- `{f}`")
+                yield f"- `{f}`"
             if len(files) > 10:
-                lines.append(f"- ...and {len(files) - 10} more")
+                yield f"- ...and {len(files) - 10} more"
 
-        commits = session.get("commits", [])
+        commits = _load_raw(session.get("commits", []))
         if commits:
-            lines.append("\n### Commits")
+            yield "\n### Commits"
             for c in commits:
-                lines.append(f"- {c}")
+                yield f"- {c}"
 
-    lines.append("\n### Conversation\n")
+    yield "\n### Conversation\n"
 
     for msg in session.get("messages", []):
-        role = "User" if msg["role"] == "user" else "Assistant"
-        lines.append(f"**{role}:** {msg['content']}\n")
+        role = _ROLE_LABEL.get(msg["role"], "Assistant")
+        yield f"**{role}:** {msg['content']}\n"
+
+    yield "---\n"
+
+
+class RawJSON(str):
+    """
+    Text that is already valid JSON, e.g. a json_group_array column.
+    stream_json splices it into compact output verbatim rather than
+    parsing and re-serializing it; markdown rendering parses it on demand.
+    """
+    __slots__ = ()
+
+
+def _load_raw(value: Any) -> Any:
+    """Parse a RawJSON value; anything else is returned unchanged."""
+    return json.loads(value) if isinstance(value, RawJSON) else value
+
 
-    lines.append("---\n")
-    return "\n".join(lines)
+def _dumps(obj: Any, pretty: bool = False) -> str:
+    """Serialize obj, indented when pretty, otherwise as compact as possible."""
+    if HAS_ORJSON:
+        option = orjson.OPT_INDENT_2 if pretty else 0  # type: ignore[possibly-undefined]
+        return orjson.dumps(obj, option=option).decode()  # type: ignore[possibly-undefined]
+    if pretty:
+        return json.dumps(obj, indent=2)
+    return json.dumps(obj, separators=(",", ":"))
 
 
-def format_json_sessions(sessions: list[dict], extra: Optional[dict] = None) -> str:
-    """Format sessions as JSON with metadata."""
-    total_messages = sum(len(s.get("messages", [])) for s in sessions)
-    output = {
-        "sessions": sessions,
-        "total_sessions": len(sessions),
+def _write_session(out: TextIO, session: dict) -> int:
+    """
+    Write a session compactly, copying RawJSON values verbatim and writing
+    messages one at a time (they may be a lazy iterator).
+    Returns the number of messages written.
+    """
+    count = 0
+    out.write("{")
+    for i, (key, value) in enumerate(session.items()):
+        if i:
+            out.write(",")
+        out.write(f"{_dumps(key)}:")
+        if isinstance(value, RawJSON):
+            out.write(value)
+        elif key == "messages":
+            out.write("[")
+            for count, message in enumerate(value, 1):
+                if count > 1:
+                    out.write(",")
+                out.write(_dumps(message))
+            out.write("]")
+        else:
+            out.write(_dumps(value))
+    out.write("}")
+    return count
+
+
+def stream_json(
+    sessions: Iterable[dict],
+    extra: Optional[dict] = None,
+    out: Optional[TextIO] = None,
+    pretty: Optional[bool] = None,
+) -> None:
+    """
+    Write sessions as JSON with metadata to out (default stdout), one session
+    (and one message) at a time, so the whole document is never built in memory.
+    Indented only when pretty is set, which defaults to out being a terminal;
+    piped output (the usual case) is compact and copies RawJSON values verbatim.
+    """
+    out = out or sys.stdout
+    if pretty is None:
+        pretty = out.isatty()
+
+    # Fetch the first session before writing, so a failing query leaves no
+    # partial document behind for the caller's error report to follow
+    sessions = iter(sessions)
+    first = next(sessions, None)
+    if first is not None:
+        sessions = chain([first], sessions)
+
+    total_sessions = 0
+    total_messages = 0
+    out.write('{\n  "sessions": [' if pretty else '{"sessions":[')
+    for session in sessions:
+        if total_sessions:
+            out.write(",")
+        if pretty:
+            parsed = {k: list(v) if k == "messages" else _load_raw(v) for k, v in session.items()}
+            out.write("\n" + textwrap.indent(_dumps(parsed, pretty=True), "    "))
+            total_messages += len(parsed.get("messages", []))
+        else:
+            total_messages += _write_session(out, session)
+        total_sessions += 1
+
+    meta = {
+        "total_sessions": total_sessions,
         "total_messages": total_messages
     }
     if extra:
-        output.update(extra)
-    return json.dumps(output, indent=2)
+        meta.update(extra)
+    if pretty:
+        out.write("\n  ]," if total_sessions else "],")
+        out.write(_dumps(meta, pretty=True)[1:])
+    else:
+        out.write("]," + _dumps(meta)[1:])
+    out.write("\n")
+
+
+# Rendered script output is reused for this long by identical invocations
+OUTPUT_CACHE_TTL = 60
+
+
+class PartialOutputError(Exception):
+    """Rendering failed after output was written; the cause is chained."""
+
+
+class _TeeWriter(io.TextIOBase):
+    """
+    Text stream that writes through to out and copies everything to a temporary
+    file as it goes. The copy is best-effort: on any I/O error it is dropped.
+    """
+
+    def __init__(self, out: TextIO, tmp_path: Path):
+        self.out = out
+        self.tmp_path = tmp_path
+        self.written = False
+        try:
+            self.copy: Optional[TextIO] = open(tmp_path, "w", encoding="utf-8")
+        except OSError:
+            self.copy = None
+
+    def write(self, s: str) -> int:
+        if self.copy is not None:
+            try:
+                self.copy.write(s)
+            except OSError:
+                self.discard()
+        self.written = True
+        return self.out.write(s)
+
+    def isatty(self) -> bool:
+        return self.out.isatty()
+
+    def discard(self) -> None:
+        """Drop the copy and its temporary file."""
+        if self.copy is not None:
+            with suppress(OSError):
+                self.copy.close()
+            self.copy = None
+            self.tmp_path.unlink(missing_ok=True)
+
+    def save(self, path: Path) -> None:
+        """Atomically move the finished copy to path."""
+        if self.copy is None:
+            return
+        try:
+            self.copy.close()
+            self.copy = None
+            os.replace(self.tmp_path, path)
+        except OSError:
+            self.copy = None
+            self.tmp_path.unlink(missing_ok=True)
+
+
+def _output_cache_path(db_path: Path, key: str) -> Path:
+    """
+    Cache file for key against the current database state. The WAL file is
+    stamped too: until a checkpoint, writes change it but not the database file.
+    """
+    stamps = []
+    for path in (db_path, db_path.with_name(db_path.name + "-wal")):
+        try:
+            st = path.stat()
+            stamps.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except OSError:
+            stamps.append("-")
+    digest = hashlib.sha1("|".join([str(db_path.resolve()), *stamps, key]).encode()).hexdigest()
+    return db_path.parent / ".cache" / f"{digest}.out"
+
+
+def cached_output(db_path: Path, key: str, render: Callable[[TextIO], None]) -> None:
+    """
+    Write render's output to stdout, replaying it from an on-disk cache when
+    the same key was rendered against the same database state within
+    OUTPUT_CACHE_TTL seconds. key must capture every argument that affects
+    the output. Output is still streamed, and copied to the cache file as it
+    is written; nothing is cached if render raises. A failure after output
+    has started is raised as PartialOutputError, so callers don't append a
+    second document to it.
+    """
+    cache_path = _output_cache_path(db_path, key)
+    now = time.time()
+    cached = None
+    try:
+        if now - cache_path.stat().st_mtime < OUTPUT_CACHE_TTL:
+            cached = open(cache_path, encoding="utf-8")
+    except OSError:
+        pass
+    if cached is not None:
+        with cached:
+            shutil.copyfileobj(cached, sys.stdout)
+        return
+
+    cache_dir = cache_path.parent
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # Entries are never hit again once the database changes; prune expired ones
+        for old in cache_dir.glob("*.out"):
+            if now - old.stat().st_mtime >= OUTPUT_CACHE_TTL:
+                old.unlink(missing_ok=True)
+    except OSError:
+        pass  # Caching is best-effort
+
+    tee = _TeeWriter(sys.stdout, cache_path.with_suffix(f".{os.getpid()}.tmp"))
+    try:
+        render(tee)  # type: ignore[arg-type]
+    except Exception as e:
+        tee.discard()
+        if tee.written:
+            raise PartialOutputError(str(e)) from e
+        raise
+    except BaseException:
+        tee.discard()
+        raise
+    tee.save(cache_path)
 
 
 # Content extraction utilities
 
-def extract_text_content(content) -> tuple[str, bool, bool, str | None]:
+_FILE_TOOLS = ("Edit", "Write", "MultiEdit")
+_COMMIT_RE = re.compile(r'-m\s+["\']([^"\']+)["\']')
+_COMMAND_TAGS = ("command-name", "command-message", "command-args", "local-command-stdout")
+
+
+def _strip_command_artifacts(text: str) -> str:
     """
-    Extract text from message content.
-    Returns: (text, has_tool_use, has_thinking, tool_summary_json)
+    Remove <command-*>...</command-*> and <local-command-stdout> blocks.
 
-    tool_summary_json is a JSON string like '{"Bash":3,"Read":2}' or None.
-    Tool use markers are NOT materialized into text.
+    One str.find-driven pass per tag, equivalent to re.sub('<tag>.*?</tag>')
+    but linear: scanning stops at the first opening tag without a closing
+    one instead of retrying from every later opening tag, which made the
+    regex quadratic on long outputs with unclosed tags.
     """
-    has_tool_use = False
-    has_thinking = False
-    tool_counts: dict[str, int] = {}
+    if "command-" not in text:
+        return text
 
+    for tag in _COMMAND_TAGS:
+        open_tag, close_tag = f"<{tag}>", f"</{tag}>"
+        start = text.find(open_tag)
+        if start < 0:
+            continue
+        parts = []
+        pos = 0
+        while start >= 0:
+            end = text.find(close_tag, start + len(open_tag))
+            if end < 0:
+                break
+            parts.append(text[pos:start])
+            pos = end + len(close_tag)
+            start = text.find(open_tag, pos)
+        parts.append(text[pos:])
+        text = "".join(parts)
+
+    return text
+
+
+@dataclass(slots=True)
+class ContentInfo:
+    """Everything the import paths need from a message's content."""
+    text: str = ""
+    has_tool_use: bool = False
+    has_thinking: bool = False
+    tool_summary: str | None = None
+    files: list[str] = field(default_factory=list)
+    commits: list[str] = field(default_factory=list)
+    is_tool_result: bool = False
+
+
+def scan_content(content) -> ContentInfo:
+    """
+    Extract text, tool usage, modified files and commits from message content
+    in a single pass over the content list.
+
+    tool_summary is a JSON string like '{"Bash":3,"Read":2}' or None.
+    Tool use markers are NOT materialized into text.
+    is_tool_result is True when content is a tool result (not a real user message).
+    """
     if isinstance(content, str):
-        # Clean up command artifacts
-        text = re.sub(r'<command-name>.*?</command-name>', '', content, flags=re.DOTALL)
-        text = re.sub(r'<command-message>.*?</command-message>', '', text, flags=re.DOTALL)
-        text = re.sub(r'<command-args>.*?</command-args>', '', text, flags=re.DOTALL)
-        text = re.sub(r'<local-command-stdout>.*?</local-command-stdout>', '', text, flags=re.DOTALL)
-        return text.strip(), False, False, None
-
-    if isinstance(content, list):
-        texts = []
-        for item in content:
-            if isinstance(item, dict):
-                item_type = item.get("type", "")
-                if item_type == "text":
-                    texts.append(item.get("text", ""))
-                elif item_type == "tool_use":
-                    has_tool_use = True
-                    tool_name = item.get("name", "")
-                    if tool_name:
-                        tool_counts[tool_name] = tool_counts.get(tool_name, 0) + 1
-                elif item_type == "thinking":
-                    has_thinking = True
-        tool_summary = json.dumps(tool_counts) if tool_counts else None
-        return "\n".join(texts).strip(), has_tool_use, has_thinking, tool_summary
-
-    return "", False, False, None
-
-
-def is_tool_result(content) -> bool:
-    """Check if content is a tool result (not a real user message)."""
-    if isinstance(content, list) and content:
-        first = content[0]
-        if isinstance(first, dict) and first.get("type") == "tool_result":
-            return True
-    return False
-
-
-def extract_files_modified(content) -> list[str]:
-    """Extract file paths from Edit/Write/MultiEdit tool uses."""
-    files = []
-    if isinstance(content, list):
-        for item in content:
-            if isinstance(item, dict) and item.get("type") == "tool_use":
-                name = item.get("name", "")
+        return ContentInfo(text=_strip_command_artifacts(content).strip())
+
+    info = ContentInfo()
+    if not isinstance(content, list):
+        return info
+
+    texts = []
+    tool_counts: dict[str, int] = {}
+    for item in content:
+        if not isinstance(item, dict):
+            continue
+        item_type = item.get("type", "")
+        if item_type == "text":
+            texts.append(item.get("text", ""))
+        elif item_type == "tool_use":
+            info.has_tool_use = True
+            tool_name = item.get("name", "")
+            if not tool_name:
+                continue
+            tool_counts[tool_name] = tool_counts.get(tool_name, 0) + 1
+            if tool_name in _FILE_TOOLS:
                 inp = item.get("input", {})
-                if name in ("Edit", "Write", "MultiEdit") and "file_path" in inp:
-                    files.append(inp["file_path"])
-    return files
-
-
-def extract_commits(content) -> list[str]:
-    """Extract git commit messages from Bash tool uses."""
-    commits = []
-    if isinstance(content, list):
-        for item in content:
-            if isinstance(item, dict) and item.get("type") == "tool_use":
-                if item.get("name") == "Bash":
-                    cmd = item.get("input", {}).get("command", "")
-                    if "git commit" in cmd:
-                        m = re.search(r'-m\s+["\']([^"\']+)["\']', cmd)
-                        if m:
-                            commits.append(m.group(1)[:100])
-    return commits
+                if "file_path" in inp:
+                    info.files.append(inp["file_path"])
+            elif tool_name == "Bash":
+                cmd = item.get("input", {}).get("command", "")
+                if "git commit" in cmd:
+                    m = _COMMIT_RE.search(cmd)
+                    if m:
+                        info.commits.append(m.group(1)[:100])
+        elif item_type == "thinking":
+            info.has_thinking = True
+
+    if content:
+        first = content[0]
+        info.is_tool_result = isinstance(first, dict) and first.get("type") == "tool_result"
+    info.text = "\n".join(texts).strip()
+    info.tool_summary = json.dumps(tool_counts) if tool_counts else None
+    return info
 
 
 # JSONL parsing utilities (consolidated from sync_current.py / import_conversations.py)
 
+_json_loads = orjson.loads if HAS_ORJSON else json.loads  # type: ignore[possibly-undefined]
+
+
+def _load_jsonl_line(line: bytes):
+    """
+    Decode one raw JSONL line, or return None if it is not valid JSON.
+    Lines with invalid UTF-8 are retried with replacement characters,
+    matching what reading the file in text mode with errors="replace" gave.
+    """
+    try:
+        return _json_loads(line)
+    except ValueError:
+        pass
+    try:
+        return json.loads(line.decode("utf-8", errors="replace"))
+    except ValueError:
+        return None
+
+
 def parse_jsonl_file(filepath: Path) -> Generator[dict, None, None]:
     """Parse JSONL file, yielding user/assistant entries for import."""
-    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+    with open(filepath, "rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if len(line) < 2:
                 continue
-            try:
-                obj = json.loads(line)
-                if obj.get("isMeta"):
-                    continue
-                if obj.get("type") in ("user", "assistant"):
-                    yield obj
-            except json.JSONDecodeError:
-                pass
+            obj = _load_jsonl_line(line)
+            if obj is None or obj.get("isMeta"):
+                continue
+            if obj.get("type") in ("user", "assistant"):
+                yield obj
 
 
 def parse_all_with_uuids(filepath: Path) -> Generator[dict, None, None]:
@@ -485,17 +1341,13 @@ def parse_all_with_uuids(filepath: Path) -> Generator[dict, None, None]:
     Parse JSONL file yielding ALL entries with UUIDs.
     Used for building the parentUuid chain to find branches.
     """
-    with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+    with open(filepath, "rb") as f:
         for line in f:
-            line = line.strip()
-            if not line:
+            if len(line) < 2:
                 continue
-            try:
-                obj = json.loads(line)
-                if obj.get("uuid"):
-                    yield obj
-            except json.JSONDecodeError:
-                pass
+            obj = _load_jsonl_line(line)
+            if obj is not None and obj.get("uuid"):
+                yield obj
 
 
 def extract_session_metadata(entries: list[dict]) -> dict:
@@ -539,101 +1391,165 @@ def find_all_branches(all_entries: list[dict]) -> list[dict]:
        lead to subtrees with user messages (actual rewinds, not tree noise)
     3. For each rewind fork, collect the abandoned subtree + common prefix
     """
-    uuid_to_entry: dict[str, dict] = {}
-    uuid_to_parent: dict[str, str | None] = {}
-    children: dict[str, list[str]] = {}
-
+    # Dense integer ids: entry uuids in order of first appearance (a repeated
+    # uuid keeps its latest entry), then parent uuids that have no entry.
+    # The walks below index parallel lists instead of hashing uuid strings.
+    ids: dict[str, int] = {}
+    uuids: list[str] = []
+    entries: list[dict] = []
     for entry in all_entries:
         uuid = entry.get("uuid")
         if not uuid:
             continue
-        uuid_to_entry[uuid] = entry
-        parent = entry.get("parentUuid")
-        uuid_to_parent[uuid] = parent
-        if parent:
-            children.setdefault(parent, []).append(uuid)
-
-    if not uuid_to_entry:
+        i = ids.get(uuid)
+        if i is None:
+            ids[uuid] = len(uuids)
+            uuids.append(uuid)
+            entries.append(entry)
+        else:
+            entries[i] = entry
+
+    if not uuids:
         return []
 
+    entry_count = len(uuids)
+    types: list[str | None] = [e.get("type") for e in entries]
+    timestamps: list[str] = [e.get("timestamp") or "" for e in entries]
+    parents: list[int] = [-1] * entry_count
+    children: list[list[int]] = [[] for _ in range(entry_count)]
+
+    for entry in all_entries:
+        uuid = entry.get("uuid")
+        if not uuid:
+            continue
+        child = ids[uuid]
+        parent_uuid = entry.get("parentUuid")
+        if not parent_uuid:
+            parents[child] = -1
+            continue
+        parent = ids.get(parent_uuid)
+        if parent is None:
+            parent = ids[parent_uuid] = len(uuids)
+            uuids.append(parent_uuid)
+            types.append(None)
+            timestamps.append("")
+            parents.append(-1)
+            children.append([])
+        parents[child] = parent
+        children[parent].append(child)
+
+    # Node sets are bytearray bitmaps indexed by id (one byte per node)
+    node_count = len(uuids)
+
+    def mark_to_root(node: int, bits: bytearray) -> list[int]:
+        """Set bits from node up to the root; returns the newly marked ids in order."""
+        path: list[int] = []
+        while node >= 0 and not bits[node]:
+            bits[node] = 1
+            path.append(node)
+            node = parents[node]
+        return path
+
     # Step 1: Find active branch (latest -> root)
-    latest = max(uuid_to_entry.values(), key=lambda e: e.get("timestamp") or "")
-    active_uuids: set[str] = set()
-    current: str | None = latest["uuid"]
-    while current:
-        active_uuids.add(current)
-        current = uuid_to_parent.get(current)
+    latest = max(range(entry_count), key=timestamps.__getitem__)
+    active = bytearray(node_count)
+    active_path = mark_to_root(latest, active)
 
-    branches: list[dict] = [
-        {"leaf_uuid": latest["uuid"], "uuids": active_uuids, "is_active": True, "fork_point_uuid": None}
-    ]
+    branches: list[dict] = [{
+        "leaf_uuid": uuids[latest],
+        "uuids": set(compress(uuids, active)),
+        "is_active": True,
+        "fork_point_uuid": None,
+    }]
 
     # Step 2: Find rewind forks on the active path
-    def has_user_descendant(uuid: str, depth: int = 0) -> bool:
-        if depth > 100:
-            return False
-        entry = uuid_to_entry.get(uuid)
-        if entry and entry.get("type") == "user":
-            return True
-        for kid in children.get(uuid, []):
-            if has_user_descendant(kid, depth + 1):
-                return True
-        return False
-
-    def collect_subtree(uuid: str) -> set[str]:
-        result: set[str] = set()
-        stack = [uuid]
+    subtree_has_user: list[bool | None] = [None] * node_count
+    # Shared across calls: every node marked here is memoized before its call returns
+    in_progress = bytearray(node_count)
+
+    def has_user_descendant(root: int) -> bool:
+        """
+        True if root or anything below it is a user message.
+        Iterative post-order walk; results are memoized per node so
+        overlapping subtrees are visited once across all fork checks.
+        """
+        stack = [(root, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if subtree_has_user[node] is not None:
+                continue
+            kids = children[node]
+            if expanded:
+                subtree_has_user[node] = (
+                    types[node] == "user"
+                    or any(subtree_has_user[kid] for kid in kids)
+                )
+                continue
+            in_progress[node] = 1
+            stack.append((node, True))
+            stack.extend((kid, False) for kid in kids
+                         if subtree_has_user[kid] is None and not in_progress[kid])
+        return bool(subtree_has_user[root])
+
+    def collect_subtree(root: int) -> tuple[bytearray, list[int]]:
+        """Mark root's subtree in a fresh bitmap; also returns the marked ids."""
+        bits = bytearray(node_count)
+        nodes: list[int] = []
+        stack = [root]
         while stack:
             node = stack.pop()
-            result.add(node)
-            stack.extend(children.get(node, []))
-        return result
+            if bits[node]:
+                continue
+            bits[node] = 1
+            nodes.append(node)
+            stack.extend(children[node])
+        return bits, nodes
 
-    for uuid in active_uuids:
-        kids = children.get(uuid, [])
+    for fork in active_path:
+        kids = children[fork]
         if len(kids) <= 1:
             continue
 
         for kid in kids:
-            if kid in active_uuids:
+            if active[kid]:
                 continue
             if not has_user_descendant(kid):
                 continue
 
             # Real rewind fork — build the abandoned branch
-            # Common prefix: fork point back to root
-            prefix: set[str] = set()
-            cur: str | None = uuid
-            while cur:
-                prefix.add(cur)
-                cur = uuid_to_parent.get(cur)
-
-            subtree = collect_subtree(kid)
-            branch_uuids = prefix | subtree
-
-            subtree_entries = [uuid_to_entry[u] for u in subtree if u in uuid_to_entry]
+            branch_bits, subtree = collect_subtree(kid)
+            subtree_entries = [i for i in subtree if i < entry_count]
             if not subtree_entries:
                 continue
-            leaf = max(subtree_entries, key=lambda e: e.get("timestamp") or "")
+            leaf = max(subtree_entries, key=timestamps.__getitem__)
 
+            # Common prefix: fork point back to root
+            mark_to_root(fork, branch_bits)
             branches.append({
-                "leaf_uuid": leaf["uuid"],
-                "uuids": branch_uuids,
+                "leaf_uuid": uuids[leaf],
+                "uuids": set(compress(uuids, branch_bits)),
                 "is_active": False,
-                "fork_point_uuid": uuid,
+                "fork_point_uuid": uuids[fork],
             })
 
     return branches
 
 
-def compute_branch_metadata(entries: list[dict]) -> tuple[int, list[str], list[str]]:
+def compute_branch_metadata(
+    entries: list[dict],
+    content_info: Optional[Mapping[str, ContentInfo]] = None,
+) -> tuple[int, list[str], list[str]]:
     """
     Compute metadata for a branch's entries in one pass.
+    content_info maps entry uuid -> ContentInfo already scanned by the caller,
+    so entries shared by several branches are not rescanned for each one.
     Returns: (exchange_count, files_modified, commits)
     """
     exchange_count = 0
     all_files = []
     all_commits = []
+    files_ext = all_files.extend
+    commits_ext = all_commits.extend
     has_user = False
 
     for entry in entries:
@@ -641,10 +1557,11 @@ def compute_branch_metadata(entries: list[dict]) -> tuple[int, list[str], list[s
         if entry_type not in ("user", "assistant"):
             continue
 
-        message = entry.get("message", {})
-        content = message.get("content", "")
+        info = content_info.get(entry.get("uuid")) if content_info else None
+        if info is None:
+            info = scan_content(entry.get("message", {}).get("content", ""))
 
-        if entry_type == "user" and is_tool_result(content):
+        if entry_type == "user" and info.is_tool_result:
             continue
 
         if entry_type == "user":
@@ -653,18 +1570,118 @@ def compute_branch_metadata(entries: list[dict]) -> tuple[int, list[str], list[s
             has_user = True
 
         if entry_type == "assistant":
-            all_files.extend(extract_files_modified(content))
-            all_commits.extend(extract_commits(content))
+            files_ext(info.files)
+            commits_ext(info.commits)
 
     if has_user:
         exchange_count += 1
 
     # Deduplicate files preserving order
-    seen = {}
-    unique_files = []
-    for f in all_files:
-        if f not in seen:
-            seen[f] = True
-            unique_files.append(f)
-
-    return exchange_count, unique_files, all_commits
+    return exchange_count, list(dict.fromkeys(all_files)), all_commits
+
+
+def get_file_hash(filepath: Path) -> str:
+    """Get MD5 hash of file for change detection."""
+    h = hashlib.md5()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@dataclass(slots=True)
+class ParsedSession:
+    """
+    A session file reduced to the rows an import writes.
+    messages rows lack only the leading session_id of MESSAGE_INSERT_SQL;
+    each branch dict carries the find_all_branches keys plus started_at,
+    ended_at, exchange_count, files and commits.
+    """
+    file_hash: str
+    session_uuid: str
+    git_branch: Optional[str]
+    cwd: Optional[str]
+    messages: list[tuple] = field(default_factory=list)
+    branches: list[dict] = field(default_factory=list)
+
+
+def parse_session_file(filepath: Path, known_hash: Optional[str] = None) -> Optional[ParsedSession]:
+    """
+    Parse a session JSONL file and compute its branches without touching the
+    database, so files can be parsed in worker processes.
+    Returns None if the file hash equals known_hash or there is nothing to import.
+    """
+    file_hash = get_file_hash(filepath)
+    if file_hash == known_hash:
+        return None
+
+    # Parse all entries for branch detection
+    all_entries = list(parse_all_with_uuids(filepath))
+    if not all_entries:
+        return None
+
+    branches = find_all_branches(all_entries)
+    if not branches:
+        return None
+
+    # Parse user/assistant messages
+    entries = list(parse_jsonl_file(filepath))
+    if not entries:
+        return None
+
+    # Extract session UUID from filename
+    session_uuid = filepath.stem
+    if session_uuid.startswith("agent-"):
+        session_uuid = session_uuid[6:]
+
+    meta = extract_session_metadata(all_entries)
+    parsed = ParsedSession(file_hash, session_uuid, meta["git_branch"], meta["cwd"])
+
+    content_info = {}
+    for entry in entries:
+        entry_type = entry.get("type")
+        if entry_type not in ("user", "assistant"):
+            continue
+
+        message = entry.get("message", {})
+        info = scan_content(message.get("content", ""))
+        if entry.get("uuid"):
+            content_info[entry["uuid"]] = info
+
+        if entry_type == "user" and info.is_tool_result:
+            continue
+
+        if not info.text:
+            continue
+
+        parsed.messages.append((
+            entry.get("uuid"),
+            entry.get("parentUuid"),
+            entry.get("timestamp"),
+            entry_type,
+            info.text,
+            info.tool_summary,
+            info.has_tool_use,
+            info.has_thinking,
+        ))
+
+    for branch in branches:
+        # Filter messages to this branch
+        branch_uuids = branch["uuids"]
+        branch_msgs = [m for m in entries if m.get("uuid") in branch_uuids]
+        if not branch_msgs:
+            continue
+        branch_msgs.sort(key=lambda e: e.get("timestamp") or "")
+
+        branch_meta = extract_session_metadata(branch_msgs)
+        exchange_count, files, commits = compute_branch_metadata(branch_msgs, content_info)
+        parsed.branches.append({
+            **branch,
+            "started_at": branch_meta["started_at"],
+            "ended_at": branch_meta["ended_at"],
+            "exchange_count": exchange_count,
+            "files": files,
+            "commits": commits,
+        })
+
+    return parsed
@@ -9,13 +9,23 @@ import argparse
 import json
 import sqlite3
 import sys
+from contextlib import closing
 from pathlib import Path
+from typing import Iterator, TextIO
 
 # Local imports
 from memory_utils import (
+    BRANCH_COMMITS_JSON,
+    BRANCH_FILES_JSON,
     DEFAULT_DB_PATH,
-    format_markdown_session,
-    format_json_sessions,
+    PartialOutputError,
+    RawJSON,
+    cached_output,
+    in_list,
+    iter_markdown_session,
+    open_ro,
+    stream_branch_messages,
+    stream_json,
 )
 
 
@@ -28,14 +38,21 @@ def get_recent_sessions(
     projects: list[str] | None = None,
     verbose: bool = False
 ) -> list[dict]:
-    """Get n most recent sessions with all their messages."""
-    cursor = conn.cursor()
-
-    sql = """
-        SELECT s.id, s.uuid, b.started_at, b.ended_at, b.exchange_count,
-               b.files_modified, b.commits, s.git_branch,
-               p.name as project, p.path as project_path,
-               b.id as branch_db_id
+    """
+    Get the n most recent sessions. Each session's messages are a lazy
+    iterator (see stream_branch_messages), so consume them in order before
+    closing conn.
+    """
+    conn.row_factory = sqlite3.Row
+
+    # Files and commits are only selected when they will be shown
+    verbose_cols = (
+        f", {BRANCH_FILES_JSON} as files_json, {BRANCH_COMMITS_JSON} as commits_json"
+        if verbose else ""
+    )
+    sql = f"""
+        SELECT s.uuid, b.started_at, b.ended_at, s.git_branch,
+               p.name as project, b.id as branch_id{verbose_cols}
         FROM sessions s
         JOIN branches b ON b.session_id = s.id AND b.is_active = 1
         JOIN projects p ON s.project_id = p.id
@@ -52,61 +69,48 @@ def get_recent_sessions(
         params.append(after)
 
     if projects:
-        placeholders = ",".join("?" * len(projects))
+        placeholders, project_params = in_list(projects)
         sql += f" AND p.name IN ({placeholders})"
-        params.extend(projects)
+        params.extend(project_params)
 
     order = "DESC" if sort_order == "desc" else "ASC"
     sql += f" ORDER BY b.ended_at {order} LIMIT ?"
     params.append(n)
 
-    cursor.execute(sql, params)
-    sessions = cursor.fetchall()
-
-    results = []
-
-    for session in sessions:
-        (_session_id, uuid, started_at, ended_at, _exchange_count,
-         files_json, commits_json, git_branch, project, _project_path, branch_db_id) = session
-
-        cursor.execute("""
-            SELECT m.role, m.content, m.timestamp
-            FROM branch_messages bm
-            JOIN messages m ON bm.message_id = m.id
-            WHERE bm.branch_id = ?
-            ORDER BY m.timestamp ASC
-        """, (branch_db_id,))
-
-        messages = [{"role": r, "content": c, "timestamp": t} for r, c, t in cursor.fetchall()]
+    # At most n rows; their messages are streamed from one query
+    rows = conn.execute(sql, params).fetchall()
+    message_streams = stream_branch_messages(conn, [row["branch_id"] for row in rows])
 
+    sessions = []
+    for row, messages in zip(rows, message_streams):
         session_data = {
-            "uuid": uuid,
-            "project": project,
-            "started_at": started_at,
-            "ended_at": ended_at,
-            "git_branch": git_branch,
+            "uuid": row["uuid"],
+            "project": row["project"],
+            "started_at": row["started_at"],
+            "ended_at": row["ended_at"],
+            "git_branch": row["git_branch"],
             "messages": messages
         }
 
         if verbose:
-            session_data["files_modified"] = json.loads(files_json) if files_json else []
-            session_data["commits"] = json.loads(commits_json) if commits_json else []
+            # Already JSON arrays; passed through to the output unparsed
+            session_data["files_modified"] = RawJSON(row["files_json"] or "[]")
+            session_data["commits"] = RawJSON(row["commits_json"] or "[]")
 
-        results.append(session_data)
+        sessions.append(session_data)
 
-    return results
+    return sessions
 
 
-def format_markdown(sessions: list[dict], verbose: bool = False) -> str:
-    """Format sessions as markdown."""
+def iter_markdown(sessions: list[dict], verbose: bool = False) -> Iterator[str]:
+    """Yield sessions as markdown, one line at a time (without newlines)."""
     if not sessions:
-        return "No sessions found."
+        yield "No sessions found."
+        return
 
-    lines = [f"# Recent Conversations ({len(sessions)} sessions)\n"]
+    yield f"# Recent Conversations ({len(sessions)} sessions)\n"
     for session in sessions:
-        lines.append(format_markdown_session(session, verbose=verbose))
-
-    return "\n".join(lines)
+        yield from iter_markdown_session(session, verbose=verbose)
 
 
 def main():
@@ -131,17 +135,32 @@ def main():
             print("Error: Database not found. Run memory setup first.")
         sys.exit(1)
 
-    try:
-        conn = sqlite3.connect(args.db)
-        sessions = get_recent_sessions(conn, n=n, sort_order=args.sort_order,
-                                        before=args.before, after=args.after,
-                                        projects=projects, verbose=args.verbose)
-        conn.close()
+    def render(out: TextIO) -> None:
+        with closing(open_ro(args.db)) as conn:
+            sessions = get_recent_sessions(conn, n=n, sort_order=args.sort_order,
+                                           before=args.before, after=args.after,
+                                           projects=projects, verbose=args.verbose)
+
+            # Messages are streamed as they are written, so output while open
+            if args.format == "json":
+                stream_json(sessions, out=out)
+            else:
+                # Stream line by line rather than joining one large string
+                out.writelines(
+                    f"{line}\n" for line in iter_markdown(sessions, verbose=args.verbose)
+                )
 
-        if args.format == "json":
-            print(format_json_sessions(sessions))
-        else:
-            print(format_markdown(sessions, verbose=args.verbose))
+    try:
+        # Repeated identical calls are served from cache until the database changes
+        key = repr(("recent_chats", n, args.sort_order, args.before, args.after,
+                    projects, args.verbose, args.format, sys.stdout.isatty()))
+        cached_output(args.db, key, render)
+
+    except PartialOutputError as e:
+        # Output has already started; report on stderr rather than after it
+        sys.stdout.flush()
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
     except Exception as e:
         if args.format == "json":
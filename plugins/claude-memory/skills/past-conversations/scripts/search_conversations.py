@@ -7,116 +7,32 @@ Returns markdown by default (token-efficient), JSON with --format json.
 
 import argparse
 import json
-import sqlite3
 import sys
+from contextlib import closing
 from pathlib import Path
+from typing import Iterator, TextIO
 
 # Local imports
 from memory_utils import (
     DEFAULT_DB_PATH,
-    format_markdown_session,
-    format_json_sessions,
+    PartialOutputError,
+    cached_output,
+    iter_markdown_session,
+    open_ro,
+    search_sessions,
+    stream_json,
 )
 
 
-def search_sessions(
-    conn: sqlite3.Connection,
-    query: str,
-    max_results: int = 5,
-    projects: list[str] | None = None,
-    verbose: bool = False
-) -> list[dict]:
-    """Search for sessions containing query terms."""
-    cursor = conn.cursor()
-
-    terms = query.split()
-    if not terms:
-        return []
-
-    fts_query = " OR ".join(f'"{term}"' for term in terms)
-
-    # Find distinct session IDs with matches (messages are already deduplicated in v3)
-    sql = """
-        SELECT DISTINCT s.id
-        FROM messages_fts
-        JOIN messages m ON messages_fts.rowid = m.id
-        JOIN sessions s ON m.session_id = s.id
-        JOIN projects p ON s.project_id = p.id
-        WHERE messages_fts MATCH ?
-    """
-    params = [fts_query]
-
-    if projects:
-        placeholders = ",".join("?" * len(projects))
-        sql += f" AND p.name IN ({placeholders})"
-        params.extend(projects)
-
-    sql += " LIMIT ?"
-    params.append(max_results)
-
-    cursor.execute(sql, params)
-    session_ids = [row[0] for row in cursor.fetchall()]
-
-    if not session_ids:
-        return []
-
-    # Fetch full session details with active branch metadata
-    placeholders = ",".join("?" * len(session_ids))
-    cursor.execute(f"""
-        SELECT s.id, s.uuid, b.started_at, b.ended_at, b.files_modified,
-               b.commits, s.git_branch, p.name as project, b.id as branch_db_id
-        FROM sessions s
-        JOIN branches b ON b.session_id = s.id AND b.is_active = 1
-        JOIN projects p ON s.project_id = p.id
-        WHERE s.id IN ({placeholders})
-        ORDER BY b.ended_at DESC
-    """, session_ids)
-    sessions = cursor.fetchall()
-
-    results = []
-
-    for session in sessions:
-        _session_id, uuid, started_at, ended_at, files_json, commits_json, git_branch, project, branch_db_id = session
-
-        # Get messages for active branch via branch_messages
-        cursor.execute("""
-            SELECT m.role, m.content, m.timestamp
-            FROM branch_messages bm
-            JOIN messages m ON bm.message_id = m.id
-            WHERE bm.branch_id = ?
-            ORDER BY m.timestamp ASC
-        """, (branch_db_id,))
-
-        messages = [{"role": r, "content": c, "timestamp": t} for r, c, t in cursor.fetchall()]
-
-        session_data = {
-            "uuid": uuid,
-            "project": project,
-            "started_at": started_at,
-            "ended_at": ended_at,
-            "git_branch": git_branch,
-            "messages": messages
-        }
-
-        if verbose:
-            session_data["files_modified"] = json.loads(files_json) if files_json else []
-            session_data["commits"] = json.loads(commits_json) if commits_json else []
-
-        results.append(session_data)
-
-    return results
-
-
-def format_markdown(sessions: list[dict], query: str, verbose: bool = False) -> str:
-    """Format sessions as markdown."""
+def iter_markdown(sessions: list[dict], query: str, verbose: bool = False) -> Iterator[str]:
+    """Yield sessions as markdown, one line at a time (without newlines)."""
     if not sessions:
-        return f"No sessions found for query: {query}"
+        yield f"No sessions found for query: {query}"
+        return
 
-    lines = [f"# Search Results: \"{query}\" ({len(sessions)} sessions)\n"]
+    yield f"# Search Results: \"{query}\" ({len(sessions)} sessions)\n"
     for session in sessions:
-        lines.append(format_markdown_session(session, verbose=verbose))
-
-    return "\n".join(lines)
+        yield from iter_markdown_session(session, verbose=verbose)
 
 
 def main():
@@ -139,16 +55,31 @@ def main():
             print("Error: Database not found. Run memory setup first.")
         sys.exit(1)
 
-    try:
-        conn = sqlite3.connect(args.db)
-        sessions = search_sessions(conn, query=args.query, max_results=max_results,
-                                   projects=projects, verbose=args.verbose)
-        conn.close()
+    def render(out: TextIO) -> None:
+        with closing(open_ro(args.db)) as conn:
+            sessions = search_sessions(conn, query=args.query, max_results=max_results,
+                                       projects=projects, verbose=args.verbose)
 
-        if args.format == "json":
-            print(format_json_sessions(sessions, {"query": args.query})  )
-        else:
-            print(format_markdown(sessions, args.query, verbose=args.verbose))
+            # Messages are streamed as they are written, so output while open
+            if args.format == "json":
+                stream_json(sessions, {"query": args.query}, out=out)
+            else:
+                # Stream line by line rather than joining one large string
+                out.writelines(
+                    f"{line}\n" for line in iter_markdown(sessions, args.query, verbose=args.verbose)
+                )
+
+    try:
+        # Repeated identical calls are served from cache until the database changes
+        key = repr(("search_conversations", args.query, max_results, projects,
+                    args.verbose, args.format, sys.stdout.isatty()))
+        cached_output(args.db, key, render)
+
+    except PartialOutputError as e:
+        # Output has already started; report on stderr rather than after it
+        sys.stdout.flush()
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
 
     except Exception as e:
         if args.format == "json":